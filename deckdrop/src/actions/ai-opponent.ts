@@ -12,7 +12,7 @@ interface AIStrategy {
 
 // QLearningStrategy implements the existing Q-learning approach
 class QLearningStrategy implements AIStrategy {
-  private qTable: Record<string, Record<string, number>>;
+  private qTable: Record<string, number[]>;
   public isPlayerTwo: boolean = true;
   
   constructor() {
@@ -53,8 +53,7 @@ class QLearningStrategy implements AIStrategy {
     let bestValue = -Infinity;
     
     for (const action of validActions) {
-      const actionStr = action.toString();
-      const qValue = this.qTable[state][actionStr] || 0;
+      const qValue = this.qTable[state][action] || 0;
       streamDeck.logger.info(`Q-value for action ${action}: ${qValue}`);
       
       if (qValue > bestValue) {
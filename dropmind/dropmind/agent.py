@@ -1,6 +1,61 @@
 import json
-import pickle
 import random
+from collections import OrderedDict
+
+import numpy as np
+from environment import canonical_states, mirror_state, state_to_string, string_to_state
+from numba import njit
+
+# Column preference rank for untrained states: 2 (middle), then 1 & 3, then 0 & 4
+COLUMN_RANK = np.array([3, 1, 0, 2, 4])
+# The same ranks as a tuple, which plain ints index faster in get_action
+_COLUMN_RANK_TUPLE = tuple(COLUMN_RANK.tolist())
+
+
+@njit(cache=True)
+def _apply_updates(
+    q, rows, mirrored, actions, rewards, next_rows, next_mirrored, next_valid_masks, learning_rate, discount_factor
+):
+    """Compiled loop of QLearningAgent.update over transitions whose rows are already looked up."""
+    for i in range(len(rows)):
+        action = 4 - actions[i] if mirrored[i] else actions[i]
+
+        # Max Q-value over the valid actions of the next state, 0 when the game ended
+        max_next_q = 0.0
+        if next_valid_masks[i]:
+            max_next_q = -np.inf
+            for col in range(5):
+                if next_valid_masks[i] >> col & 1:
+                    max_next_q = max(max_next_q, q[next_rows[i], 4 - col if next_mirrored[i] else col])
+
+        current_q = q[rows[i], action]
+        q[rows[i], action] = current_q + learning_rate * (rewards[i] + discount_factor * max_next_q - current_q)
+
+
+def epsilon_greedy(q_values, valid, exploration_rates, draws):
+    """
+    Epsilon-greedy actions for a batch of Q-value rows, following QLearningAgent.get_action.
+
+    Untrained rows (all valid Q-values equal) prefer the middle columns and ties between
+    the best actions are broken at random.
+
+    Args:
+        q_values: Q-values of every state, shape (N, 5)
+        valid: Valid columns of every state, shape (N, 5)
+        exploration_rates: Exploration rate for every state, shape (N,) or a scalar
+        draws: Uniform random numbers, shape (N, 6): one per column for the tie-breaks and
+            random moves, and one to decide whether to explore
+    """
+    max_q = np.where(valid, q_values, -np.inf).max(axis=1)
+    untrained = np.where(valid, q_values, np.inf).min(axis=1) == max_q
+
+    # A random draw per column picks uniformly among the columns it is restricted to
+    column_draws = draws[:, :5]
+    best = np.argmax(column_draws * (valid & (q_values == max_q[:, None])), axis=1)
+    preferred = np.argmin(np.where(valid, COLUMN_RANK, 5), axis=1)
+    explore = np.argmax(column_draws * valid, axis=1)
+    actions = np.where(untrained, preferred, best)
+    return np.where(draws[:, 5] < exploration_rates, explore, actions)
 
 
 class QLearningAgent:
@@ -13,6 +68,8 @@ class QLearningAgent:
         exploration_rate=1.0,
         exploration_decay=0.995,
         min_exploration_rate=0.01,
+        capacity=2_000_000,
+        seed=None,
     ):
         """
         Initialize a Q-learning agent.
@@ -23,13 +80,24 @@ class QLearningAgent:
             exploration_rate: Epsilon - probability of selecting a random action
             exploration_decay: Rate at which exploration decreases over time
             min_exploration_rate: Minimum exploration rate
+            capacity: Maximum number of states kept; the least recently used state is evicted beyond it
+            seed: Seed for the agent's random number generator
         """
-        self.q_table = {}  # State-action values
+        # State-action values, one row of 5 action values per state
+        self.q = np.zeros((1024, 5), dtype=np.float32)
+        self.index = OrderedDict()  # State -> row in self.q, least recently used first
+        self._changed = np.zeros(len(self.q), dtype=np.bool_)  # Rows changed since the last save
+        self.capacity = capacity
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
         self.exploration_rate = exploration_rate
         self.exploration_decay = exploration_decay
         self.min_exploration_rate = min_exploration_rate
+        # Bound method of a per-agent generator; scaling one uniform draw picks
+        # an index faster than random.choice
+        self._random = random.Random(seed).random
+        # NumPy generator for the draws of batched action selection
+        self._generator = np.random.default_rng(seed)
 
     def get_action(self, state, valid_actions):
         """
@@ -37,7 +105,7 @@ class QLearningAgent:
 
         Args:
             state: Current state representation
-            valid_actions: List of valid actions
+            valid_actions: Tuple of valid actions
 
         Returns:
             Selected action
@@ -47,34 +115,84 @@ class QLearningAgent:
             return None
 
         # Exploration: random action
-        if random.random() < self.exploration_rate:
-            return random.choice(valid_actions)
+        if self._random() < self.exploration_rate:
+            return valid_actions[int(self._random() * len(valid_actions))]
 
         # Exploitation: best known action
         return self._get_best_action(state, valid_actions)
 
+    def get_actions(self, states, valid):
+        """
+        Choose actions for a batch of states at once, as get_action does for each of them.
+
+        Args:
+            states: State of every game (int64 array)
+            valid: Valid columns of every game, boolean array of shape (N, 5)
+
+        Returns:
+            Selected action for every game
+        """
+        draws = self._generator.random((len(states), 6))
+
+        # Like get_action, only states that are exploited are looked up (and added to the table)
+        q_values = np.zeros((len(states), 5), dtype=np.float32)
+        exploit = np.flatnonzero(draws[:, 5] >= self.exploration_rate)
+        keys, mirrored = canonical_states(states[exploit])
+        rows = np.fromiter(map(self._row, keys.tolist()), dtype=np.intp, count=len(keys))
+        q_values[exploit] = np.where(mirrored[:, None], self.q[rows, ::-1], self.q[rows])
+        return epsilon_greedy(q_values, valid, self.exploration_rate, draws)
+
+    def _canonical(self, state):
+        """
+        Map a state and its left-right mirror image to the same Q-table key, as environment.canonical_state_nb.
+
+        The pure-Python mirror_state is faster than a call into compiled code for a single state.
+        """
+        mirrored = mirror_state(state)
+        if mirrored < state:
+            return mirrored, True
+        return state, False
+
+    def _row(self, state):
+        """Get the Q-table row for a state, adding a zero-initialized row if it is new."""
+        row = self.index.get(state)
+        if row is not None:
+            self.index.move_to_end(state)
+            return row
+
+        if len(self.index) >= self.capacity:
+            # Reuse the row of the least recently used state
+            _, row = self.index.popitem(last=False)
+            self.q[row] = 0.0
+        else:
+            row = len(self.index)
+            if row == len(self.q):
+                # Double the capacity; new rows start at zero
+                self.q = np.concatenate((self.q, np.zeros_like(self.q)))
+                self._changed = np.concatenate((self._changed, np.zeros_like(self._changed)))
+        self.index[state] = row
+        self._changed[row] = True
+        return row
+
     def _get_best_action(self, state, valid_actions):
         """Get the best action for the current state based on Q-values."""
-        # Initialize Q-values for this state if not already in table
-        if state not in self.q_table:
-            self.q_table[state] = {action: 0.0 for action in range(5)}
+        key, mirrored = self._canonical(state)
+        row = self._row(key)  # May grow self.q, so look it up first
+        # A row is only 5 values: plain floats beat NumPy calls on such tiny arrays
+        values = self.q[row].tolist()
+        if mirrored:
+            values.reverse()
+        q_values = [values[a] for a in valid_actions]
+        max_q = max(q_values)
 
         # If all Q-values are the same (e.g., all 0 for a new state)
         # prefer the middle column and columns closer to the middle
-        q_values = [self.q_table[state].get(action, 0.0) for action in valid_actions]
-        if all(q == q_values[0] for q in q_values):
-            # Column preference: 2 (middle), then 1 & 3, then 0 & 4
-            preference_order = [2, 1, 3, 0, 4]
-            for col in preference_order:
-                if col in valid_actions:
-                    return col
-
-        # Find action with highest Q-value
-        max_q = max(self.q_table[state].get(action, 0.0) for action in valid_actions)
+        if min(q_values) == max_q:
+            return min(valid_actions, key=_COLUMN_RANK_TUPLE.__getitem__)
 
         # If multiple actions have the same max Q-value, randomly select one
-        best_actions = [action for action in valid_actions if self.q_table[state].get(action, 0.0) == max_q]
-        return random.choice(best_actions)
+        best_actions = [a for a, q in zip(valid_actions, q_values) if q == max_q]
+        return best_actions[int(self._random() * len(best_actions))]
 
     def update(self, state, action, reward, next_state, next_valid_actions):
         """
@@ -87,47 +205,191 @@ class QLearningAgent:
             next_state: Next state representation
             next_valid_actions: Valid actions in the next state
         """
-        # Initialize Q-values if state not in table
-        if state not in self.q_table:
-            self.q_table[state] = {a: 0.0 for a in range(5)}
-
-        # Initialize next state if needed
-        if next_state not in self.q_table and next_valid_actions:
-            self.q_table[next_state] = {a: 0.0 for a in range(5)}
+        key, mirrored = self._canonical(state)
+        row = self._row(key)
+        if mirrored:
+            action = 4 - action
 
         # Get max Q-value for next state
         max_next_q = 0.0
         if next_valid_actions:
-            max_next_q = max(self.q_table[next_state].get(a, 0.0) for a in next_valid_actions)
+            next_key, next_mirrored = self._canonical(next_state)
+            next_row = self._row(next_key)
+            next_values = self.q[next_row].tolist()
+            if next_mirrored:
+                next_values.reverse()
+            max_next_q = max(next_values[a] for a in next_valid_actions)
 
         # Q-learning update formula (Q(s,a) = Q(s,a) + α[r + γ*max(Q(s',a')) - Q(s,a)])
-        current_q = self.q_table[state].get(action, 0.0)
-        new_q = current_q + self.learning_rate * (reward + self.discount_factor * max_next_q - current_q)
-        self.q_table[state][action] = new_q
+        current_q = self.q[row, action]
+        self.q[row, action] = current_q + self.learning_rate * (reward + self.discount_factor * max_next_q - current_q)
+        self._changed[row] = True
+
+    def update_batch(self, states, actions, rewards, next_states, next_valid_masks):
+        """
+        Update Q-values from a sequence of transitions, in order.
+
+        Gives the same result as calling update for every transition, but only the Q-table
+        row lookups run in Python; the updates themselves run in compiled loops.
+
+        Args:
+            states: State of every transition (int64 array)
+            actions: Action taken in every transition
+            rewards: Reward received in every transition
+            next_states: Next state of every transition (int64 array)
+            next_valid_masks: Valid actions in every next state as a bitmask (bit a for action a), 0 when terminal
+        """
+        keys, mirrored = canonical_states(states)
+        next_keys, next_mirrored = canonical_states(next_states)
+
+        # The rows of a chunk are all looked up before its updates run. A transition touches at
+        # most two rows, so a chunk of capacity // 2 transitions never evicts a row it still
+        # needs itself, and later chunks only evict rows after their updates were written
+        chunk_size = max(1, self.capacity // 2)
+        for start in range(0, len(keys), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            self._update_chunk(
+                keys[chunk],
+                mirrored[chunk],
+                actions[chunk],
+                rewards[chunk],
+                next_keys[chunk],
+                next_mirrored[chunk],
+                next_valid_masks[chunk],
+            )
+
+    def _update_chunk(self, keys, mirrored, actions, rewards, next_keys, next_mirrored, next_valid_masks):
+        """Look up the rows of a chunk of update_batch transitions, then update them in one compiled loop."""
+        # Look up rows in the same order as update, so new states and evictions match
+        rows = np.empty(len(keys), dtype=np.intp)
+        next_rows = np.zeros(len(keys), dtype=np.intp)
+        for i, (key, next_key, next_mask) in enumerate(
+            zip(keys.tolist(), next_keys.tolist(), next_valid_masks.tolist())
+        ):
+            rows[i] = self._row(key)
+            if next_mask:
+                next_rows[i] = self._row(next_key)
+
+        _apply_updates(
+            self.q,
+            rows,
+            mirrored,
+            actions,
+            rewards,
+            next_rows,
+            next_mirrored,
+            next_valid_masks,
+            self.learning_rate,
+            self.discount_factor,
+        )
+        self._changed[rows] = True
+
+    def copy(self):
+        """
+        Return an independent copy of the agent, for example to freeze it as an opponent.
+
+        Much cheaper than copy.deepcopy, which walks every state of the Q-table: the Q-values
+        are copied as one array and the index with a single C-level dict copy.
+        """
+        clone = QLearningAgent.__new__(QLearningAgent)
+        clone.__dict__.update(self.__dict__)
+        clone.q = self.q.copy()
+        clone.index = self.index.copy()
+        clone._changed = self._changed.copy()
+        # Continue from the same random state, with a generator of its own
+        generator = random.Random()
+        generator.setstate(self._random.__self__.getstate())
+        clone._random = generator.random
+        clone._generator = np.random.default_rng()
+        clone._generator.bit_generator.state = self._generator.bit_generator.state
+        return clone
 
     def decay_exploration(self):
         """Decay the exploration rate."""
         self.exploration_rate = max(self.min_exploration_rate, self.exploration_rate * self.exploration_decay)
 
-    def save_qtable_pickle(self, filename):
-        """Save the Q-table to a pickle file."""
-        with open(filename, "wb") as f:
-            pickle.dump(self.q_table, f)
+    def snapshot(self, changed_only=False):
+        """
+        Copy the Q-table into plain arrays.
+
+        Args:
+            changed_only: Only copy the states added or updated since the last save
+
+        Returns:
+            keys: Sorted state keys
+            q: Q-values of those states, one row per key
+        """
+        keys = np.fromiter(self.index, dtype=np.int64, count=len(self.index))
+        rows = np.fromiter(self.index.values(), dtype=np.intp, count=len(self.index))
+        if changed_only:
+            changed = self._changed[rows]
+            keys, rows = keys[changed], rows[changed]
+        order = keys.argsort()
+        return keys[order], self.q[rows[order]]
+
+    def save_qtable_npz(self, filename, quantize=True, changed_only=False):
+        """
+        Save the Q-table to a compressed NumPy archive.
+
+        With quantize, Q-values are stored as int16 with one scale for the whole table
+        (q = q_int16 * scale), half the size of float32. The rounding error is at most
+        scale / 2, which is max|Q| / 65534.
 
-    def load_qtable_pickle(self, filename):
-        """Load the Q-table from a pickle file."""
-        with open(filename, "rb") as f:
-            self.q_table = pickle.load(f)
+        With changed_only, only the states added or updated since the last save are written,
+        so periodic checkpoints stay small as the table grows. Such an archive is loaded on
+        top of the earlier ones with merge_qtable_npz. Evicted states are not recorded, so
+        merged checkpoints can hold states the agent has since dropped.
+        """
+        keys, q = self.snapshot(changed_only)
+        self._changed[:] = False
+        if not quantize:
+            np.savez_compressed(filename, q=q, keys=keys)
+            return
+        scale = float(np.abs(q).max(initial=0.0)) / np.iinfo(np.int16).max or 1.0
+        np.savez_compressed(filename, q_int16=np.round(q / scale).astype(np.int16), scale=scale, keys=keys)
+
+    def load_qtable_npz(self, filename):
+        """
+        Load the Q-table from a compressed NumPy archive, quantized or not.
+
+        Raises ValueError if the archive holds more states than the agent's capacity.
+        """
+        with np.load(filename) as data:
+            keys = data["keys"]
+            if len(keys) > self.capacity:
+                raise ValueError(f"{filename} holds {len(keys)} states, more than the capacity of {self.capacity}")
+            self.q = np.zeros((max(1024, 2 * len(keys)), 5), dtype=np.float32)
+            if "q_int16" in data.files:
+                self.q[: len(keys)] = data["q_int16"] * data["scale"]
+            else:
+                self.q[: len(keys)] = data["q"]
+        self.index = OrderedDict((state, row) for row, state in enumerate(keys.tolist()))
+        self._changed = np.zeros(len(self.q), dtype=np.bool_)
+        self._changed[: len(keys)] = True
+
+    def merge_qtable_npz(self, filename):
+        """Load a compressed NumPy archive on top of the current Q-table, replacing the states it holds."""
+        with np.load(filename) as data:
+            keys = data["keys"]
+            q = data["q_int16"] * data["scale"] if "q_int16" in data.files else data["q"]
+        for state, values in zip(keys.tolist(), q):
+            row = self._row(state)  # May grow self.q, so look it up first
+            self.q[row] = values
 
     def save_qtable_json(self, filename):
         """
         Save the Q-table to a JSON file for TypeScript integration.
-        Converts dictionary keys to strings for JSON compatibility.
+        Every board string maps to the list of its 5 action values.
+        Mirrored states are written out as well, since the plugin looks up the exact board.
         """
-        # Convert inner dictionaries' numeric keys to strings
+        # Convert packed states to board strings
         json_compatible = {}
-        for state, actions in self.q_table.items():
-            json_compatible[state] = {str(action): value for action, value in actions.items()}
+        for state, row in self.index.items():
+            values = self.q[row].tolist()
+            json_compatible[state_to_string(state)] = values
+            mirrored = mirror_state(state)
+            if mirrored != state:
+                json_compatible[state_to_string(mirrored)] = values[::-1]
 
         with open(filename, "w") as f:
             json.dump(json_compatible, f)
@@ -135,16 +397,28 @@ class QLearningAgent:
     def load_qtable_json(self, filename):
         """
         Load the Q-table from a JSON file.
-        Converts string keys back to integers for the actions.
+        Converts board strings back to packed states.
+        Raises ValueError if the file holds more states than the agent's capacity.
         """
         with open(filename, "r") as f:
             json_table = json.load(f)
 
-        # Convert string action keys back to integers
-        self.q_table = {}
-        for state, actions in json_table.items():
-            self.q_table[state] = {int(action): value for action, value in actions.items()}
+        # Convert board strings back to canonical states, the canonical entry wins over its mirror
+        table = {}
+        for state, values in json_table.items():
+            key, mirrored = self._canonical(string_to_state(state))
+            if not mirrored or key not in table:
+                table[key] = values[::-1] if mirrored else values
+        if len(table) > self.capacity:
+            raise ValueError(f"{filename} holds {len(table)} states, more than the capacity of {self.capacity}")
+
+        # Fill one row per state
+        self.index = OrderedDict()
+        self.q = np.zeros((max(1024, 2 * len(table)), 5), dtype=np.float32)
+        self._changed = np.zeros(len(self.q), dtype=np.bool_)
+        for key, values in table.items():
+            self.q[self._row(key)] = values
 
     def get_q_table_size(self):
         """Return the number of states in the Q-table."""
-        return len(self.q_table)
+        return len(self.index)
@@ -1,12 +1,11 @@
-import json
+import shutil
 
-# Load the JSON file
-with open("dropmind/models/qtable_final.json", "r") as f:
-    qtable = json.load(f)
-
-# Create a TypeScript file
-with open("../deckdrop/src/actions//q-table.ts", "w") as f:
-    f.write("// Auto-generated Q-table\n")
-    f.write("export const qTableData = ")
-    json.dump(qtable, f)
-    f.write(";\n")
+# Copy the JSON Q-table straight into a TypeScript file, no need to parse it
+with (
+    open("dropmind/models/qtable_final.json", "rb") as f_in,
+    open("../deckdrop/src/actions/q-table.ts", "wb") as f_out,
+):
+    f_out.write(b"// Auto-generated Q-table\n")
+    f_out.write(b"export const qTableData = ")
+    shutil.copyfileobj(f_in, f_out, length=1 << 20)
+    f_out.write(b";\n")
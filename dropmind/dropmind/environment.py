@@ -1,4 +1,376 @@
 import numpy as np
+from numba import njit
+
+
+def state_to_string(state):
+    """Convert a packed state key to the 15-character board string used by the TypeScript plugin."""
+    return "".join(str((state >> (2 * i)) & 3) for i in range(15))
+
+
+def string_to_state(board_string):
+    """Convert a 15-character board string back to a packed state key."""
+    return sum(int(cell) << (2 * i) for i, cell in enumerate(board_string))
+
+
+def _mirror_row(bits):
+    """Reverse the order of the five 2-bit cells in one packed board row."""
+    return sum(((bits >> (2 * c)) & 3) << (2 * (4 - c)) for c in range(5))
+
+
+_MIRROR_ROW = [_mirror_row(bits) for bits in range(1 << 10)]
+
+
+def mirror_state(state):
+    """Flip a packed state left to right, so column c becomes column 4 - c."""
+    return _MIRROR_ROW[state & 0x3FF] | _MIRROR_ROW[(state >> 10) & 0x3FF] << 10 | _MIRROR_ROW[state >> 20] << 20
+
+
+_MIRROR_ROW_TABLE = np.array(_MIRROR_ROW, dtype=np.int64)
+
+
+@njit(cache=True)
+def mirror_state_nb(state):
+    """Compiled mirror_state, for use inside other kernels."""
+    return (
+        _MIRROR_ROW_TABLE[state & 0x3FF]
+        | _MIRROR_ROW_TABLE[(state >> 10) & 0x3FF] << 10
+        | _MIRROR_ROW_TABLE[state >> 20] << 20
+    )
+
+
+@njit(cache=True)
+def canonical_state_nb(state):
+    """
+    Map a state and its left-right mirror image to the same key, the smaller of the two.
+
+    The board and rewards are symmetric, so both can share one Q-table row. Returns the key
+    and whether the state was mirrored, in which case action a maps to 4 - a.
+    """
+    mirrored = mirror_state_nb(state)
+    if mirrored < state:
+        return mirrored, True
+    return state, False
+
+
+@njit(cache=True)
+def canonical_states(states):
+    """canonical_state_nb for an int64 array of states, returning the keys and whether each was mirrored."""
+    keys = np.empty_like(states)
+    mirrored = np.empty(len(states), dtype=np.bool_)
+    for i in range(len(states)):
+        keys[i], mirrored[i] = canonical_state_nb(states[i])
+    return keys, mirrored
+
+
+# Low bit of every 2-bit cell in a packed state
+_LOW_CELL_BITS = sum(1 << (2 * i) for i in range(15))
+
+
+def swap_players(state):
+    """Swap players 1 and 2 in a packed state, e.g. to see the board as the other player."""
+    # Each cell is two bits (01 for player 1, 10 for player 2), so swapping the bits within
+    # every pair swaps the players; works element-wise on int64 arrays too
+    return ((state & _LOW_CELL_BITS) << 1) | ((state >> 1) & _LOW_CELL_BITS)
+
+
+# Compiled swap_players, for use inside other kernels
+swap_players_nb = njit(cache=True)(swap_players)
+
+
+def _mask(cells):
+    """Build a bitboard with bit r * 5 + c set for every (r, c) cell."""
+    return sum(1 << (r * 5 + c) for r, c in cells)
+
+
+FULL_BOARD = (1 << 15) - 1
+BOTTOM_ROW = _mask((2, c) for c in range(5))
+CENTER_BOTTOM = _mask([(2, 2)])
+CENTER_COLUMN = _mask((r, 2) for r in range(3))
+MIDDLE_COLUMNS = _mask((r, c) for r in range(3) for c in range(1, 4))
+COLUMN_MASKS = tuple(_mask((r, c) for r in range(3)) for c in range(5))
+TOP_ROW = _mask((0, c) for c in range(5))
+# Valid columns for every occupancy pattern of the top row (bit c set when column c is full).
+VALID_ACTIONS = tuple(tuple(c for c in range(5) if not occupied >> c & 1) for occupied in range(1 << 5))
+
+# Every three-in-a-row line on the 3x5 board as (row, col) cells, enumerated once
+HORIZONTAL_CELLS = tuple(tuple((r, c + i) for i in range(3)) for r in range(3) for c in range(3))
+VERTICAL_CELLS = tuple(tuple((r, c) for r in range(3)) for c in range(5))
+DIAGONAL_CELLS = tuple(tuple((2 - i, c + i) for i in range(3)) for c in range(3)) + tuple(
+    tuple((i, c + i) for i in range(3)) for c in range(3)
+)
+LINE_CELLS = HORIZONTAL_CELLS + VERTICAL_CELLS + DIAGONAL_CELLS
+
+# The same lines as bitboard masks
+HORIZONTAL_LINES = tuple(_mask(cells) for cells in HORIZONTAL_CELLS)
+VERTICAL_LINES = tuple(_mask(cells) for cells in VERTICAL_CELLS)
+DIAGONAL_LINES = tuple(_mask(cells) for cells in DIAGONAL_CELLS)
+LINES = HORIZONTAL_LINES + VERTICAL_LINES + DIAGONAL_LINES
+
+
+def _lines_through():
+    """
+    Table of the lines through each cell (indexed r * 5 + c); only these can be completed
+    by a piece there. Rows are padded with a mask outside the board, which is never complete.
+    """
+    lines_per_cell = [[line for line in LINES if line >> cell & 1] for cell in range(15)]
+    table = np.full((15, max(map(len, lines_per_cell))), 1 << 15, dtype=np.int64)
+    for cell, lines in enumerate(lines_per_cell):
+        table[cell, : len(lines)] = lines
+    return table
+
+
+LINES_THROUGH = _lines_through()
+
+# Per-line scoring for the state value, aligned with LINES: whether immediate threats need
+# the open cell to be playable (diagonals skip the gravity check), and the immediate attack
+# and block values. Vertical threats include the stacked-pieces bonus (9 + 8.5 to complete,
+# 10 + 9.5 to block)
+_LINE_BITBOARDS = np.array(LINES, dtype=np.int64)
+_LINE_GRAVITY = np.array([True] * len(HORIZONTAL_LINES) + [True] * len(VERTICAL_LINES) + [False] * len(DIAGONAL_LINES))
+_LINE_ATTACK = np.array([7.0] * len(HORIZONTAL_LINES) + [17.5] * len(VERTICAL_LINES) + [7.0] * len(DIAGONAL_LINES))
+_LINE_BLOCK = np.array([8.0] * len(HORIZONTAL_LINES) + [19.5] * len(VERTICAL_LINES) + [8.0] * len(DIAGONAL_LINES))
+
+
+def _lines_touched():
+    """
+    Table of the line indices whose state value can change when a piece lands on each cell:
+    the lines through the cell, and the gravity-checked lines through the cell above it,
+    which becomes playable. Rows are padded with -1; int8 keeps the table in a few cache lines.
+    """
+    lines_per_cell = []
+    for cell in range(15):
+        above = 1 << (cell - 5) if cell >= 5 else 0
+        lines_per_cell.append(
+            [i for i, line in enumerate(LINES) if line >> cell & 1 or (_LINE_GRAVITY[i] and line & above)]
+        )
+    table = np.full((15, max(map(len, lines_per_cell))), -1, dtype=np.int8)
+    for cell, lines in enumerate(lines_per_cell):
+        table[cell, : len(lines)] = lines
+    return table
+
+
+LINES_TOUCHED = _lines_touched()
+
+
+@njit(cache=True)
+def _popcount(x):
+    """
+    Count the set bits of a 15-bit bitboard (int.bit_count is not available in nopython mode).
+
+    Branch-free SWAR count: sums adjacent bit pairs, then nibbles, then bytes.
+    """
+    x = x - ((x >> 1) & 0x5555)
+    x = (x & 0x3333) + ((x >> 2) & 0x3333)
+    x = (x + (x >> 4)) & 0x0F0F
+    return (x + (x >> 8)) & 0x1F
+
+
+@njit(cache=True)
+def _check_win_nb(bitboard, cell):
+    """Check if a player's bitboard contains a complete line through the given cell."""
+    for line in LINES_THROUGH[cell]:
+        if bitboard & line == line:
+            return True
+    return False
+
+
+@njit(cache=True)
+def _line_value(player_bb, opponent_bb, empty, droppable, i):
+    """
+    Value of line i for the player, and whether (1) or not (0) it is an immediate threat
+    for the player and for the opponent.
+    """
+    line = _LINE_BITBOARDS[i]
+    if not empty & line:
+        return 0.0, 0, 0
+    # Two in a line with the third cell open is a potential threat; it is an immediate
+    # threat when the open cell can be played now (diagonals skip the gravity check)
+    immediate = (droppable if _LINE_GRAVITY[i] else empty) & line != 0
+    if _popcount(player_bb & line) == 2:
+        if immediate:
+            return 1.0 + _LINE_ATTACK[i], 1, 0
+        return 1.0, 0, 0
+    if _popcount(opponent_bb & line) == 2:
+        if immediate:
+            return -0.7 - _LINE_BLOCK[i], 0, 1
+        return -0.7, 0, 0
+    return 0.0, 0, 0
+
+
+@njit(cache=True)
+def _state_value_nb(player_bb, opponent_bb, is_player_one):
+    """Compiled body of ConnectThreeEnv._calculate_state_value."""
+    occupied = player_bb | opponent_bb
+    empty = FULL_BOARD & ~occupied
+    # Empty cells a piece would land in right now: bottom row or directly on top of a piece
+    droppable = empty & (BOTTOM_ROW | (occupied >> 5))
+    state_value = 0.0
+
+    player_immediate_threats = 0
+    opponent_immediate_threats = 0
+    for i in range(len(_LINE_BITBOARDS)):
+        value, player_threat, opponent_threat = _line_value(player_bb, opponent_bb, empty, droppable, i)
+        state_value += value
+        player_immediate_threats += player_threat
+        opponent_immediate_threats += opponent_threat
+
+    # --- Fork detection (multiple threats) ---
+    if player_immediate_threats >= 2:
+        state_value += 8.0
+    if opponent_immediate_threats >= 2:
+        state_value -= 11.0
+
+    # --- Strategic position evaluation ---
+    # Bottom center is prime real estate
+    if player_bb & CENTER_BOTTOM:
+        state_value += 0.4
+    if opponent_bb & CENTER_BOTTOM:
+        state_value -= 0.3
+
+    # Middle column control
+    state_value += 0.3 * _popcount(player_bb & CENTER_COLUMN)
+    state_value -= 0.2 * _popcount(opponent_bb & CENTER_COLUMN)
+
+    # Middle three columns are usually strategically better
+    player_middle = _popcount(player_bb & MIDDLE_COLUMNS)
+    state_value += 0.2 * player_middle
+    state_value -= 0.15 * _popcount(opponent_bb & MIDDLE_COLUMNS)
+
+    # First-move advantage: in the early game player 1 should take center positions
+    if is_player_one and _popcount(occupied) <= 2:
+        state_value += 0.2 * player_middle
+
+    return state_value
+
+
+@njit(cache=True)
+def _state_value_delta_nb(player_bb, opponent_bb, droppable, cell, is_player_one, player_threats, opponent_threats):
+    """
+    Change of _state_value_nb for the player when they drop a piece on cell.
+
+    Only the lines in LINES_TOUCHED[cell] are evaluated; the fork terms need the number of
+    immediate threats of both players before the move, which are updated along the way.
+
+    Args:
+        player_bb: The player's bitboard before the move
+        opponent_bb: The opponent's bitboard
+        droppable: Empty cells a piece would land in before the move
+        cell: Cell (r * 5 + c) the piece lands on
+        is_player_one: Whether the player is player 1
+        player_threats: The player's immediate threats before the move
+        opponent_threats: The opponent's immediate threats before the move
+
+    Returns:
+        The change in state value and both players' immediate threats after the move
+    """
+    bit = 1 << cell
+    occupied = player_bb | opponent_bb
+    empty = FULL_BOARD & ~occupied
+    after_bb = player_bb | bit
+    empty_after = empty & ~bit
+    # The cell is filled and the one above it becomes playable
+    droppable_after = droppable ^ (bit | bit >> 5)
+
+    delta = 0.0
+    new_player_threats = player_threats
+    new_opponent_threats = opponent_threats
+    for i in LINES_TOUCHED[cell]:
+        if i < 0:
+            break
+        before, player_before, opponent_before = _line_value(player_bb, opponent_bb, empty, droppable, i)
+        after, player_after, opponent_after = _line_value(after_bb, opponent_bb, empty_after, droppable_after, i)
+        delta += after - before
+        new_player_threats += player_after - player_before
+        new_opponent_threats += opponent_after - opponent_before
+
+    # Fork terms switch on and off with the threat counts
+    delta += 8.0 * (int(new_player_threats >= 2) - int(player_threats >= 2))
+    delta -= 11.0 * (int(new_opponent_threats >= 2) - int(opponent_threats >= 2))
+
+    # Positional terms of the new piece
+    if bit & CENTER_BOTTOM:
+        delta += 0.4
+    if bit & CENTER_COLUMN:
+        delta += 0.3
+    if bit & MIDDLE_COLUMNS:
+        delta += 0.2
+
+    # First-move bonus, which depends on the number of pieces on the board
+    if is_player_one:
+        pieces = _popcount(occupied)
+        player_middle = _popcount(player_bb & MIDDLE_COLUMNS)
+        if pieces <= 2:
+            delta -= 0.2 * player_middle
+        if pieces + 1 <= 2:
+            delta += 0.2 * _popcount(after_bb & MIDDLE_COLUMNS)
+
+    return delta, new_player_threats, new_opponent_threats
+
+
+# Outcomes of a move, as returned by step_nb
+MOVE_INVALID = 0
+MOVE_PLAYED = 1
+MOVE_WON = 2
+MOVE_DRAW = 3
+
+# ANSI escape that moves the cursor home and clears the terminal, for rendering games in place
+# (no clear/cls subprocess per frame; Windows 10+ terminals understand it too)
+CLEAR_SCREEN = "\x1b[H\x1b[2J"
+
+
+@njit(cache=True)
+def step_nb(
+    player_bb, opponent_bb, droppable, is_player_one, action, intermediate_rewards, player_threats, opponent_threats
+):
+    """
+    Compiled body of ConnectThreeEnv.step: validate the move, find the cell the piece lands
+    on, check for a win or a draw and compute the reward, in one call.
+
+    Args:
+        player_bb: Bitboard of the player to move
+        opponent_bb: Bitboard of the opponent
+        droppable: Empty cells a piece would land in, one per column that has room
+        is_player_one: Whether the player to move is player 1
+        action: Column to drop the piece in
+        intermediate_rewards: Whether to add the pattern-based intermediate reward
+        player_threats: The player's immediate threats before the move
+        opponent_threats: The opponent's immediate threats before the move
+
+    Returns:
+        outcome: One of MOVE_INVALID, MOVE_PLAYED, MOVE_WON or MOVE_DRAW
+        cell: Cell (r * 5 + c) the piece lands on, -1 for an invalid move
+        reward: Reward for the move
+        pattern_reward: Intermediate reward included in reward, 0.0 if there is none
+        player_threats, opponent_threats: Immediate threats after the move
+    """
+    if action < 0 or action >= 5:
+        return MOVE_INVALID, -1, -10.0, 0.0, player_threats, opponent_threats
+    # A full column has no droppable cell
+    landing = droppable & COLUMN_MASKS[action]
+    if not landing:
+        return MOVE_INVALID, -1, -10.0, 0.0, player_threats, opponent_threats
+
+    cell = action
+    while not landing >> cell & 1:
+        cell += 5
+    occupied = player_bb | opponent_bb
+
+    if _check_win_nb(player_bb | 1 << cell, cell):
+        return MOVE_WON, cell, 1.0 if is_player_one else -1.0, 0.0, player_threats, opponent_threats
+    if occupied | 1 << cell == FULL_BOARD:
+        return MOVE_DRAW, cell, 0.2, 0.0, player_threats, opponent_threats  # Small positive reward for draw
+
+    reward = -0.05  # Small negative reward for non-terminal move (encourages faster winning)
+    pattern_reward = 0.0
+    if intermediate_rewards:
+        # Change in state value, from the lines the new piece touches only
+        state_improvement, player_threats, opponent_threats = _state_value_delta_nb(
+            player_bb, opponent_bb, droppable, cell, is_player_one, player_threats, opponent_threats
+        )
+        if state_improvement > 0:
+            pattern_reward = 0.1 * state_improvement  # Scale factor can be tuned
+            reward += pattern_reward
+    return MOVE_PLAYED, cell, reward, pattern_reward, player_threats, opponent_threats
 
 
 class ConnectThreeEnv:
@@ -9,23 +381,51 @@ class ConnectThreeEnv:
     Enhanced with intermediate rewards for partial patterns.
     """
 
+    # Fixed attribute slots: no per-instance dict, and faster attribute access in step
+    __slots__ = (
+        "p1_bb",
+        "p2_bb",
+        "_state",
+        "_droppable",
+        "current_player",
+        "done",
+        "winner",
+        "intermediate_rewards",
+        "_p1_threats",
+        "_p2_threats",
+    )
+
     def __init__(self, intermediate_rewards=True):
-        # Board is 3x5, 0 for empty, 1 for player 1, 2 for player 2
-        self.board = np.zeros((3, 5), dtype=int)
+        # The board is one bitboard per player, bit r * 5 + c is set when the player occupies (r, c)
+        self.p1_bb = 0
+        self.p2_bb = 0
+        # Packed state key, 2 bits per cell, updated as pieces are placed
+        self._state = 0
+        # Empty cells a piece would land in: the bottom row, then the cell above each piece
+        self._droppable = BOTTOM_ROW
         self.current_player = 1
         self.done = False
         self.winner = None
         self.intermediate_rewards = intermediate_rewards
-        # Keep track of previous state for calculating state-based rewards
-        self.previous_player_state = {1: None, 2: None}
+        # Compile (or load from cache) the JIT kernels up front instead of on the first step
+        _check_win_nb(0, 0)
+        _state_value_nb(0, 0, True)
+        step_nb(0, 0, BOTTOM_ROW, True, 2, True, 0, 0)
+        # Immediate threats of each player, kept up to date for the intermediate rewards
+        self._p1_threats = 0
+        self._p2_threats = 0
 
     def reset(self):
         """Reset the environment for a new game."""
-        self.board = np.zeros((3, 5), dtype=int)
+        self.p1_bb = 0
+        self.p2_bb = 0
+        self._state = 0
+        self._droppable = BOTTOM_ROW
         self.current_player = 1
         self.done = False
         self.winner = None
-        self.previous_player_state = {1: None, 2: None}
+        self._p1_threats = 0
+        self._p2_threats = 0
         return self._get_state()
 
     def step(self, action):
@@ -39,102 +439,57 @@ class ConnectThreeEnv:
             state: The new state representation
             reward: Reward for the action
             done: Whether the game is finished
-            info: Additional information
+            invalid: 1 if the action was an invalid move, otherwise 0
         """
-        info = {}
-
-        # Check if the action is valid
-        if not self._is_valid_action(action):
-            return self._get_state(), -10, self.done, {"invalid_move": True}
-
-        # Store the previous state value for this player
-        self.previous_player_state[self.current_player] = self._calculate_state_value(self.current_player)
-
-        # Drop the piece in the selected column
-        row = self._get_next_open_row(action)
-        self.board[row][action] = self.current_player
-
-        # Check for win
-        if self._check_win():
+        player = self.current_player
+        if player == 1:
+            outcome, cell, reward, _, self._p1_threats, self._p2_threats = step_nb(
+                self.p1_bb,
+                self.p2_bb,
+                self._droppable,
+                True,
+                action,
+                self.intermediate_rewards,
+                self._p1_threats,
+                self._p2_threats,
+            )
+        else:
+            outcome, cell, reward, _, self._p2_threats, self._p1_threats = step_nb(
+                self.p2_bb,
+                self.p1_bb,
+                self._droppable,
+                False,
+                action,
+                self.intermediate_rewards,
+                self._p2_threats,
+                self._p1_threats,
+            )
+
+        if outcome == MOVE_INVALID:
+            return self._state, -10, self.done, 1
+
+        # Record the piece; the cell above it becomes droppable
+        bit = 1 << cell
+        self._state |= player << (2 * cell)
+        if player == 1:
+            self.p1_bb |= bit
+        else:
+            self.p2_bb |= bit
+        self._droppable ^= bit | bit >> 5
+
+        if outcome == MOVE_WON:
             self.done = True
-            self.winner = self.current_player
-            reward = 1.0 if self.current_player == 1 else -1.0
-            return self._get_state(), reward, self.done, {"winner": self.current_player}
+            self.winner = player
+            return self._state, reward, self.done, 0
 
-        # Check for draw
-        if self._is_board_full():
+        if outcome == MOVE_DRAW:
             self.done = True
-            reward = 0.2  # Small positive reward for draw
-            return self._get_state(), reward, self.done, {"draw": True}
-
-        # Calculate rewards based on state improvement
-        reward = -0.05  # Small negative reward for non-terminal move (encourages faster winning)
-
-        # Add intermediate rewards if enabled
-        if self.intermediate_rewards:
-            current_state_value = self._calculate_state_value(self.current_player)
-            previous_state_value = self.previous_player_state[self.current_player] or 0
-
-            # Calculate change in state value
-            state_improvement = current_state_value - previous_state_value
-
-            # Add scaled intermediate reward
-            if state_improvement > 0:
-                reward += 0.1 * state_improvement  # Scale factor can be tuned
-                info["pattern_reward"] = 0.1 * state_improvement
+            return self._state, reward, self.done, 0
 
         # Switch player
-        self.current_player = 3 - self.current_player  # 1 -> 2, 2 -> 1
-
-        return self._get_state(), reward, self.done, info
-
-    def _get_next_open_row(self, col):
-        """Find the next open row in the given column."""
-        for r in range(2, -1, -1):  # Start from bottom row
-            if self.board[r][col] == 0:
-                return r
-        return -1  # Column is full
-
-    def _is_valid_action(self, action):
-        """Check if the action is valid."""
-        if action < 0 or action >= 5:  # Out of bounds
-            return False
-        return self.board[0][action] == 0  # Top row must be empty
-
-    def _is_board_full(self):
-        """Check if the board is full."""
-        return (self.board != 0).all()
-
-    def _check_win(self):
-        """Check if the current player has won (connected three pieces)."""
-        player = self.current_player
-        board = self.board
+        self.current_player = 3 - player  # 1 -> 2, 2 -> 1
 
-        # Check horizontal
-        for r in range(3):
-            for c in range(3):  # Up to 3 to check 3 in a row
-                if board[r][c] == player and board[r][c + 1] == player and board[r][c + 2] == player:
-                    return True
-
-        # Check vertical
-        for r in range(1):  # Only bottom row can start a vertical win (3 rows total)
-            for c in range(5):
-                if board[r][c] == player and board[r + 1][c] == player and board[r + 2][c] == player:
-                    return True
-
-        # Check diagonal (/)
-        for r in range(2, 3):  # Start from bottom rows
-            for c in range(3):  # Up to 3 to check 3 in a row
-                if board[r][c] == player and board[r - 1][c + 1] == player and board[r - 2][c + 2] == player:
-                    return True
-
-        # Check diagonal (\)
-        for r in range(1):  # Start from top rows
-            for c in range(3):  # Up to 3 to check 3 in a row
-                if board[r][c] == player and board[r + 1][c + 1] == player and board[r + 2][c + 2] == player:
-                    return True
-
-        return False
+        return self._state, reward, self.done, 0
 
     def _calculate_state_value(self, player):
         """
@@ -144,261 +499,19 @@ class ConnectThreeEnv:
         Returns:
             float: A value representing the "goodness" of the state for the player
         """
-        board = self.board
-        opponent = 3 - player
-        state_value = 0
-
-        # Track immediate threats for both players
-        player_immediate_threats = 0
-        opponent_immediate_threats = 0
-        player_potential_threats = 0
-        opponent_potential_threats = 0
-
-        # HIGHEST PRIORITY: Check for one-move win/block situations FIRST
-        # This ensures the agent never misses an immediate win or block
-
-        # 1. Check if opponent has a winning move - HIGHEST PRIORITY BLOCK
-        for c in range(5):
-            # Check vertical win in one move
-            if c < 5 and board[2][c] == opponent and board[1][c] == opponent and board[0][c] == 0:
-                # Opponent can win with one move vertically - MUST BLOCK
-                state_value -= 10.0  # Substantially negative value for critical threats
-                opponent_immediate_threats += 1
-
-        # 2. Check if player has a winning move - HIGHEST PRIORITY ATTACK
-        for c in range(5):
-            # Check vertical win in one move
-            if c < 5 and board[2][c] == player and board[1][c] == player and board[0][c] == 0:
-                state_value += 9.0
-                player_immediate_threats += 1
-
-        # Check horizontal immediate threats
-        for r in range(3):
-            for c in range(3):
-                # Opponent's immediate winning move - high priority block
-                if (
-                    (
-                        board[r][c] == opponent
-                        and board[r][c + 1] == opponent
-                        and board[r][c + 2] == 0
-                        and (r == 2 or board[r + 1][c + 2] != 0)
-                    )
-                    or (
-                        board[r][c] == opponent
-                        and board[r][c + 1] == 0
-                        and board[r][c + 2] == opponent
-                        and (r == 2 or board[r + 1][c + 1] != 0)
-                    )
-                    or (
-                        board[r][c] == 0
-                        and board[r][c + 1] == opponent
-                        and board[r][c + 2] == opponent
-                        and (r == 2 or board[r + 1][c] != 0)
-                    )
-                ):
-                    opponent_immediate_threats += 1
-                    state_value -= 8.0  # FIXED: now negative to avoid these states
-
-                # Player's immediate winning move
-                if (
-                    (
-                        board[r][c] == player
-                        and board[r][c + 1] == player
-                        and board[r][c + 2] == 0
-                        and (r == 2 or board[r + 1][c + 2] != 0)
-                    )
-                    or (
-                        board[r][c] == player
-                        and board[r][c + 1] == 0
-                        and board[r][c + 2] == player
-                        and (r == 2 or board[r + 1][c + 1] != 0)
-                    )
-                    or (
-                        board[r][c] == 0
-                        and board[r][c + 1] == player
-                        and board[r][c + 2] == player
-                        and (r == 2 or board[r + 1][c] != 0)
-                    )
-                ):
-                    player_immediate_threats += 1
-                    state_value += 7.0
-
-                # Two horizontal with open third (potential threats)
-                if (
-                    (board[r][c] == player and board[r][c + 1] == player and board[r][c + 2] == 0)
-                    or (board[r][c] == player and board[r][c + 1] == 0 and board[r][c + 2] == player)
-                    or (board[r][c] == 0 and board[r][c + 1] == player and board[r][c + 2] == player)
-                ):
-                    player_potential_threats += 1
-                    state_value += 1.0
-
-                # Opponent two horizontal with open third (defensive value)
-                if (
-                    (board[r][c] == opponent and board[r][c + 1] == opponent and board[r][c + 2] == 0)
-                    or (board[r][c] == opponent and board[r][c + 1] == 0 and board[r][c + 2] == opponent)
-                    or (board[r][c] == 0 and board[r][c + 1] == opponent and board[r][c + 2] == opponent)
-                ):
-                    opponent_potential_threats += 1
-                    state_value -= 0.7  # FIXED: now negative to avoid these states
-
-        # Check vertical potential threats (beyond immediate threats)
-        for r in range(1):
-            for c in range(5):
-                # Two vertical with open third (potential threats)
-                if (
-                    (board[r][c] == player and board[r + 1][c] == player and board[r + 2][c] == 0)
-                    or (board[r][c] == player and board[r + 1][c] == 0 and board[r + 2][c] == player)
-                    or (board[r][c] == 0 and board[r + 1][c] == player and board[r + 2][c] == player)
-                ):
-                    player_potential_threats += 1
-                    state_value += 1.0
-
-                # Opponent two vertical with open third (defensive value)
-                if (
-                    (board[r][c] == opponent and board[r + 1][c] == opponent and board[r + 2][c] == 0)
-                    or (board[r][c] == opponent and board[r + 1][c] == 0 and board[r + 2][c] == opponent)
-                    or (board[r][c] == 0 and board[r + 1][c] == opponent and board[r + 2][c] == opponent)
-                ):
-                    opponent_potential_threats += 1
-                    state_value -= 0.7  # FIXED: now negative to avoid these states
-
-        # Check for stacked pieces with potential for a third (partial vertical threats)
-        for c in range(5):
-            # Special case for two stacked pieces
-            if board[2][c] == opponent and board[1][c] == opponent and board[0][c] == 0:
-                state_value -= 9.5  # FIXED: Very high priority to block vertical threats
-
-            if board[2][c] == player and board[1][c] == player and board[0][c] == 0:
-                state_value += 8.5  # High priority to complete vertical threats
-
-        # Check diagonal immediate threats (/)
-        for r in range(2, 3):
-            for c in range(3):
-                # Player's immediate diagonal (/) winning move
-                if (
-                    (board[r][c] == player and board[r - 1][c + 1] == player and board[r - 2][c + 2] == 0)
-                    or (board[r][c] == player and board[r - 1][c + 1] == 0 and board[r - 2][c + 2] == player)
-                    or (board[r][c] == 0 and board[r - 1][c + 1] == player and board[r - 2][c + 2] == player)
-                ):
-                    player_immediate_threats += 1
-                    state_value += 7.0
-
-                # Opponent's immediate diagonal (/) winning move
-                if (
-                    (board[r][c] == opponent and board[r - 1][c + 1] == opponent and board[r - 2][c + 2] == 0)
-                    or (board[r][c] == opponent and board[r - 1][c + 1] == 0 and board[r - 2][c + 2] == opponent)
-                    or (board[r][c] == 0 and board[r - 1][c + 1] == opponent and board[r - 2][c + 2] == opponent)
-                ):
-                    opponent_immediate_threats += 1
-                    state_value -= 8.0  # FIXED: now negative to avoid these states
-
-                # Two diagonal / with open third (potential threats)
-                if (
-                    (board[r][c] == player and board[r - 1][c + 1] == player and board[r - 2][c + 2] == 0)
-                    or (board[r][c] == player and board[r - 1][c + 1] == 0 and board[r - 2][c + 2] == player)
-                    or (board[r][c] == 0 and board[r - 1][c + 1] == player and board[r - 2][c + 2] == player)
-                ):
-                    player_potential_threats += 1
-                    state_value += 1.0
-
-                # Opponent two diagonal / with open third (defensive value)
-                if (
-                    (board[r][c] == opponent and board[r - 1][c + 1] == opponent and board[r - 2][c + 2] == 0)
-                    or (board[r][c] == opponent and board[r - 1][c + 1] == 0 and board[r - 2][c + 2] == opponent)
-                    or (board[r][c] == 0 and board[r - 1][c + 1] == opponent and board[r - 2][c + 2] == opponent)
-                ):
-                    opponent_potential_threats += 1
-                    state_value -= 0.7  # FIXED: now negative to avoid these states
-
-        # Check diagonal immediate threats (\)
-        for r in range(1):
-            for c in range(3):
-                # Player's immediate diagonal (\) winning move
-                if (
-                    (board[r][c] == player and board[r + 1][c + 1] == player and board[r + 2][c + 2] == 0)
-                    or (board[r][c] == player and board[r + 1][c + 1] == 0 and board[r + 2][c + 2] == player)
-                    or (board[r][c] == 0 and board[r + 1][c + 1] == player and board[r + 2][c + 2] == player)
-                ):
-                    player_immediate_threats += 1
-                    state_value += 7.0
-
-                # Opponent's immediate diagonal (\) winning move
-                if (
-                    (board[r][c] == opponent and board[r + 1][c + 1] == opponent and board[r + 2][c + 2] == 0)
-                    or (board[r][c] == opponent and board[r + 1][c + 1] == 0 and board[r + 2][c + 2] == opponent)
-                    or (board[r][c] == 0 and board[r + 1][c + 1] == opponent and board[r + 2][c + 2] == opponent)
-                ):
-                    opponent_immediate_threats += 1
-                    state_value -= 8.0  # FIXED: now negative to avoid these states
-
-                # Two diagonal \ with open third (potential threats)
-                if (
-                    (board[r][c] == player and board[r + 1][c + 1] == player and board[r + 2][c + 2] == 0)
-                    or (board[r][c] == player and board[r + 1][c + 1] == 0 and board[r + 2][c + 2] == player)
-                    or (board[r][c] == 0 and board[r + 1][c + 1] == player and board[r + 2][c + 2] == player)
-                ):
-                    player_potential_threats += 1
-                    state_value += 1.0
-
-                # Opponent two diagonal \ with open third (defensive value)
-                if (
-                    (board[r][c] == opponent and board[r + 1][c + 1] == opponent and board[r + 2][c + 2] == 0)
-                    or (board[r][c] == opponent and board[r + 1][c + 1] == 0 and board[r + 2][c + 2] == opponent)
-                    or (board[r][c] == 0 and board[r + 1][c + 1] == opponent and board[r + 2][c + 2] == opponent)
-                ):
-                    opponent_potential_threats += 1
-                    state_value -= 0.7  # FIXED: now negative to avoid these states
-
-        # --- Fork detection (multiple threats) ---
-        # If player has 2+ immediate threats, that's a fork (almost guaranteed win)
-        if player_immediate_threats >= 2:
-            state_value += 8.0
-
-        # If opponent has 2+ immediate threats, that's a defensive emergency
-        if opponent_immediate_threats >= 2:
-            state_value -= 11.0  # FIXED: now negative to avoid these states
-
-        # --- Strategic position evaluation ---
-        # Center control (more nuanced than before)
-        # Bottom row center is most valuable
-        if board[2][2] == player:
-            state_value += 0.4  # Bottom center is prime real estate
-
-        # Penalize opponent control of center
-        if board[2][2] == opponent:
-            state_value -= 0.3  # ADDED: new penalty for opponent center control
-
-        # Middle column control (refined)
-        center_control = sum(1 for r in range(3) if board[r][2] == player)
-        state_value += 0.3 * center_control
-
-        # Penalize opponent middle column control
-        opponent_center = sum(1 for r in range(3) if board[r][2] == opponent)
-        state_value -= 0.2 * opponent_center  # ADDED: new penalty for opponent center control
-
-        # Add value for center positions (usually strategically better)
-        for r in range(3):
-            for c in range(1, 4):  # middle 3 columns
-                if board[r][c] == player:
-                    state_value += 0.2
-                elif board[r][c] == opponent:  # ADDED: penalty for opponent center positions
-                    state_value -= 0.15
-
-        # First-move advantage (if player is player 1)
-        if player == 1 and np.sum(board != 0) <= 2:
-            # In early game, player 1 should take center positions
-            state_value += 0.2 * sum(1 for r in range(3) for c in range(1, 4) if board[r][c] == player)
-
-        return state_value
+        if player == 1:
+            return _state_value_nb(self.p1_bb, self.p2_bb, True)
+        return _state_value_nb(self.p2_bb, self.p1_bb, False)
 
     def _get_state(self):
         """Convert the current board to a state representation."""
-        # Simple string representation of the board
-        return "".join([str(cell) for row in self.board for cell in row])
+        # Base-4 integer, one digit per cell, kept up to date by step
+        return self._state
 
     def get_valid_actions(self):
-        """Return a list of valid actions."""
-        return [col for col in range(5) if self._is_valid_action(col)]
+        """Return a tuple of valid actions."""
+        # A column is full once its top cell is taken, and the top row is bits 0-4
+        return VALID_ACTIONS[(self.p1_bb | self.p2_bb) & TOP_ROW]
 
     def render(self):
         """Print the current board state."""
@@ -407,9 +520,9 @@ class ConnectThreeEnv:
         for r in range(3):
             print("|", end=" ")
             for c in range(5):
-                if self.board[r][c] == 0:
+                if not (self.p1_bb | self.p2_bb) >> (r * 5 + c) & 1:
                     print(".", end=" ")
-                elif self.board[r][c] == 1:
+                elif self.p1_bb >> (r * 5 + c) & 1:
                     print("X", end=" ")
                 else:
                     print("O", end=" ")
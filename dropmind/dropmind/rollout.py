@@ -0,0 +1,261 @@
+import numpy as np
+from agent import COLUMN_RANK, epsilon_greedy
+from environment import (
+    BOTTOM_ROW,
+    MOVE_PLAYED,
+    MOVE_WON,
+    canonical_state_nb,
+    canonical_states,
+    step_nb,
+    swap_players,
+    swap_players_nb,
+)
+from numba import njit, prange
+from vec_environment import VecConnectThreeEnv
+
+# A game never lasts longer than the 15 cells of the board
+MAX_MOVES = 15
+
+
+@njit(cache=True)
+def _pack_state(p1_bb, p2_bb):
+    """Pack two bitboards into the same base-4 state as ConnectThreeEnv._get_state."""
+    state = 0
+    for cell in range(15):
+        if p1_bb >> cell & 1:
+            state |= 1 << (2 * cell)
+        elif p2_bb >> cell & 1:
+            state |= 2 << (2 * cell)
+    return state
+
+
+@njit(cache=True)
+def _select_action(keys, q, state, valid_actions, n_valid, exploration_rate):
+    """Epsilon-greedy action on a frozen Q-table, following QLearningAgent.get_action."""
+    if np.random.random() < exploration_rate:
+        return valid_actions[int(np.random.random() * n_valid)]
+
+    # Mirror-image states share a row, with actions flipped
+    key, flip = canonical_state_nb(state)
+    pos = np.searchsorted(keys, key)
+    known = pos < len(keys) and keys[pos] == key
+
+    q_values = np.zeros(n_valid, dtype=np.float32)
+    if known:
+        for i in range(n_valid):
+            action = valid_actions[i]
+            q_values[i] = q[pos, 4 - action if flip else action]
+    max_q = q_values.max()
+
+    # All Q-values equal: prefer the middle column and columns closer to the middle
+    if q_values.min() == max_q:
+        best = valid_actions[0]
+        for i in range(1, n_valid):
+            if COLUMN_RANK[valid_actions[i]] < COLUMN_RANK[best]:
+                best = valid_actions[i]
+        return best
+
+    # Randomly break ties between the actions with the highest Q-value
+    n_best = 0
+    for i in range(n_valid):
+        if q_values[i] == max_q:
+            n_best += 1
+    pick = int(np.random.random() * n_best)
+    for i in range(n_valid):
+        if q_values[i] == max_q:
+            if pick == 0:
+                return valid_actions[i]
+            pick -= 1
+    return valid_actions[0]
+
+
+@njit(cache=True, parallel=True, nogil=True)
+def play_episodes(
+    primary_keys,
+    primary_q,
+    opponent_keys,
+    opponent_q,
+    primary_players,
+    primary_exploration_rates,
+    opponent_exploration_rates,
+    seeds,
+    intermediate_rewards,
+    swap_opponent=True,
+):
+    """
+    Play one self-play game per entry of seeds, in parallel across CPU cores.
+
+    Both agents act from frozen Q-table snapshots (sorted state keys and their Q-value
+    rows, see QLearningAgent.snapshot), so the games can run on separate threads; the
+    caller learns from the recorded transitions afterwards. The opponent sees the board
+    with the players swapped when it plays as player 2, unless swap_opponent is off (an
+    agent that plays both sides against itself sees the board as it is). Rewards follow
+    ConnectThreeEnv.
+
+    Args:
+        primary_keys, primary_q: Snapshot of the primary agent's Q-table
+        opponent_keys, opponent_q: Snapshot of the opponent agent's Q-table
+        primary_players: Player (1 or 2) the primary agent plays as, per game
+        primary_exploration_rates: Primary agent's exploration rate, per game
+        opponent_exploration_rates: Opponent agent's exploration rate, per game
+        seeds: Random seed per game
+        intermediate_rewards: Whether to add the pattern-based intermediate rewards
+        swap_opponent: Whether the opponent sees the board with the players swapped as player 2
+
+    Returns:
+        states: State before every move plus the final state, shape (n, MAX_MOVES + 1)
+        actions: Column played at every move, shape (n, MAX_MOVES)
+        rewards: Environment reward for every move, shape (n, MAX_MOVES)
+        valid_masks: Bitmask of valid columns in every state, shape (n, MAX_MOVES + 1)
+        lengths: Number of moves in every game
+        winners: Winning player of every game, 0 for a draw
+    """
+    n = len(seeds)
+    states = np.zeros((n, MAX_MOVES + 1), dtype=np.int64)
+    actions = np.zeros((n, MAX_MOVES), dtype=np.int8)
+    rewards = np.zeros((n, MAX_MOVES), dtype=np.float64)
+    valid_masks = np.zeros((n, MAX_MOVES + 1), dtype=np.int8)
+    lengths = np.zeros(n, dtype=np.int64)
+    winners = np.zeros(n, dtype=np.int8)
+
+    for game in prange(n):
+        np.random.seed(seeds[game])
+        p1_bb = 0
+        p2_bb = 0
+        droppable = BOTTOM_ROW
+        player = 1
+        threats = np.zeros(3, dtype=np.int64)  # Immediate threats per player, see ConnectThreeEnv
+        valid_actions = np.empty(5, dtype=np.int64)
+
+        for move in range(MAX_MOVES):
+            occupied = p1_bb | p2_bb
+            state = _pack_state(p1_bb, p2_bb)
+            states[game, move] = state
+
+            # A column is playable while its top cell is empty
+            n_valid = 0
+            for col in range(5):
+                if not occupied >> col & 1:
+                    valid_actions[n_valid] = col
+                    n_valid += 1
+                    valid_masks[game, move] |= 1 << col
+
+            if player == primary_players[game]:
+                action = _select_action(
+                    primary_keys, primary_q, state, valid_actions, n_valid, primary_exploration_rates[game]
+                )
+            else:
+                opponent_state = swap_players_nb(state) if swap_opponent and player == 2 else state
+                action = _select_action(
+                    opponent_keys, opponent_q, opponent_state, valid_actions, n_valid, opponent_exploration_rates[game]
+                )
+            actions[game, move] = action
+
+            player_bb = p1_bb if player == 1 else p2_bb
+            opponent_bb = p2_bb if player == 1 else p1_bb
+            outcome, cell, reward, _, threats[player], threats[3 - player] = step_nb(
+                player_bb,
+                opponent_bb,
+                droppable,
+                player == 1,
+                action,
+                intermediate_rewards,
+                threats[player],
+                threats[3 - player],
+            )
+            rewards[game, move] = reward
+            if player == 1:
+                p1_bb |= 1 << cell
+            else:
+                p2_bb |= 1 << cell
+            droppable ^= (1 << cell) | (1 << cell) >> 5
+
+            if outcome != MOVE_PLAYED:
+                winners[game] = player if outcome == MOVE_WON else 0
+                lengths[game] = move + 1
+                break
+            player = 3 - player
+
+        states[game, lengths[game]] = _pack_state(p1_bb, p2_bb)
+
+    return states, actions, rewards, valid_masks, lengths, winners
+
+
+def _select_actions(keys, q, states, valid, exploration_rates, draws):
+    """
+    Epsilon-greedy actions for a batch of states on a frozen Q-table, one lookup for all of them.
+
+    Follows _select_action: mirror-image states share a row, see agent.epsilon_greedy for
+    the arguments.
+    """
+    states, flip = canonical_states(states)
+
+    # Rows of unknown states are all zero
+    q_values = np.zeros((len(states), 5), dtype=np.float32)
+    if len(keys):
+        pos = np.minimum(np.searchsorted(keys, states), len(keys) - 1)
+        known = keys[pos] == states
+        q_values[known] = q[pos[known]]
+    q_values = np.where(flip[:, None], q_values[:, ::-1], q_values)
+    return epsilon_greedy(q_values, valid, exploration_rates, draws)
+
+
+def play_episodes_vec(
+    primary_keys,
+    primary_q,
+    opponent_keys,
+    opponent_q,
+    primary_players,
+    primary_exploration_rates,
+    opponent_exploration_rates,
+    seeds,
+    intermediate_rewards,
+    swap_opponent=True,
+):
+    """
+    Play one self-play game per entry of seeds, all stepped together on a VecConnectThreeEnv.
+
+    Takes the same arguments and returns the same recordings as play_episodes, but moves
+    the whole batch with NumPy instead of compiling a per-game loop; finished games
+    sit out the remaining steps. Only the random draws differ.
+    """
+    n = len(seeds)
+    states = np.zeros((n, MAX_MOVES + 1), dtype=np.int64)
+    actions = np.zeros((n, MAX_MOVES), dtype=np.int8)
+    rewards = np.zeros((n, MAX_MOVES), dtype=np.float64)
+    valid_masks = np.zeros((n, MAX_MOVES + 1), dtype=np.int8)
+    lengths = np.zeros(n, dtype=np.int64)
+    winners = np.zeros(n, dtype=np.int8)
+
+    rng = np.random.default_rng(seeds)
+    env = VecConnectThreeEnv(n, intermediate_rewards=intermediate_rewards)
+    current = env.reset()
+    column_bits = 1 << np.arange(5, dtype=np.int8)
+
+    for move in range(MAX_MOVES):
+        alive = ~env.done
+        if not alive.any():
+            break
+        valid = env.get_valid_actions()
+        states[alive, move] = current[alive]
+        valid_masks[alive, move] = (valid[alive] * column_bits).sum(axis=1)
+
+        # Both agents choose for every game, each game keeps the choice of the agent to move,
+        # so they can share one block of random numbers drawn for the whole step
+        draws = rng.random((n, 6))
+        primary_turns = env.current_player == primary_players
+        opponent_states = np.where(swap_opponent & (env.current_player == 2), swap_players(current), current)
+        move_actions = np.where(
+            primary_turns,
+            _select_actions(primary_keys, primary_q, current, valid, primary_exploration_rates, draws),
+            _select_actions(opponent_keys, opponent_q, opponent_states, valid, opponent_exploration_rates, draws),
+        )
+        actions[alive, move] = move_actions[alive]
+
+        current, move_rewards, dones = env.step(move_actions)
+        rewards[alive, move] = move_rewards[alive]
+        lengths[alive & dones] = move + 1
+
+    winners[:] = env.winner
+    states[np.arange(n), lengths] = current
+    return states, actions, rewards, valid_masks, lengths, winners
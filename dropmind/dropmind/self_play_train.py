@@ -1,13 +1,17 @@
 import argparse
-import copy
+import math
 import os
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-import matplotlib.pyplot as plt
 import numpy as np
 from agent import QLearningAgent
-from environment import ConnectThreeEnv
+from environment import CLEAR_SCREEN, ConnectThreeEnv, swap_players
+from matplotlib.figure import Figure
+from rollout import play_episodes, play_episodes_vec
 from tqdm import tqdm
+from training_utils import check_finished_saves, window_average
 
 
 def self_play_train(
@@ -20,11 +24,37 @@ def self_play_train(
     min_exploration_rate=0.01,
     opponent_update_interval=500,
     save_json=True,
+    json_interval=None,
     render_interval=0,
+    rollout_batch=1,
+    overlap_rollouts=False,
+    vector_env=False,
+    player1_only=False,
 ):
     """
     Train the Q-learning agent using self-play with alternating player roles.
+
+    With player1_only, the primary agent always plays as player 1 and only learns from
+    its own moves; its models are saved with a player1_ prefix.
+
+    With rollout_batch > 1, games are played in batches of that size in parallel from
+    snapshots of both agents taken at the start of each batch (see rollout.play_episodes),
+    and the primary agent learns from them afterwards, one game at a time. Rendering is
+    only available when playing sequentially.
+
+    With overlap_rollouts, the next batch is played in the background while the primary
+    agent learns from the current one, so the cores never wait for the learner. The games
+    are then played by a policy that is one batch behind.
+
+    With vector_env, a batch is stepped together on a VecConnectThreeEnv with NumPy
+    (see rollout.play_episodes_vec) instead of in the compiled parallel game loop.
     """
+    # JSON checkpoints are slow to write and only needed for the TypeScript plugin, so fewer of them
+    if json_interval is None:
+        json_interval = save_interval * 10
+    if json_interval <= 0:
+        raise ValueError(f"json_interval must be positive, got {json_interval}")
+
     # Create output directories
     os.makedirs("./dropmind/models", exist_ok=True)
     os.makedirs("./dropmind/graphs", exist_ok=True)
@@ -42,372 +72,346 @@ def self_play_train(
     )
 
     # Opponent agent (updated periodically from primary agent)
-    opponent_agent = copy.deepcopy(primary_agent)
-
-    # Metrics
-    primary_wins = []
-    opponent_wins = []
-    draws = []
-    rewards = []
-    q_table_sizes = []
-    exploration_rates = []
-    elo_ratings = [1000]  # Starting ELO rating
+    opponent_agent = primary_agent.copy()
+
+    # Model file prefix and agent names in the progress output
+    prefix = "player1_" if player1_only else ""
+    primary_label, opponent_label = ("player 1", "player 2") if player1_only else ("primary", "opponent")
+
+    # Metrics, preallocated with one entry per episode
+    primary_wins = np.zeros(episodes, dtype=np.int8)
+    opponent_wins = np.zeros(episodes, dtype=np.int8)
+    draws = np.zeros(episodes, dtype=np.int8)
+    rewards = np.zeros(episodes, dtype=np.float32)
+    q_table_sizes = np.zeros(episodes, dtype=np.int64)
+    exploration_rates = np.zeros(episodes, dtype=np.float32)
+    elo_ratings = np.zeros(episodes + 1)  # Rating before every episode and after the last one
+    elo_ratings[0] = 1000  # Starting ELO rating
 
     start_time = time.time()
 
-    # Training loop
-    for episode in tqdm(range(episodes)):
-        state = env.reset()
+    # Periodic JSON checkpoints are written on a background thread while training continues
+    json_executor = ThreadPoolExecutor(max_workers=1)
+    json_saves = []
 
+    # Games played in parallel that are still waiting to be learned from
+    rollouts = deque()
+    rollout_rng = np.random.default_rng()
+    # Background thread playing the next batch, and the future of that batch
+    rollout_executor = ThreadPoolExecutor(max_workers=1) if overlap_rollouts and rollout_batch > 1 else None
+    next_rollouts = None
+    # The opponent is frozen between updates, so its snapshot is shared by every batch until the next one
+    opponent_snapshot = None
+
+    # Training loop
+    # Refresh the progress bar at most once a second, with a steadier ETA after the JIT warmup
+    for episode in tqdm(range(episodes), mininterval=1.0, miniters=max(1, episodes // 1000), smoothing=0.1):
         # Alternate which player the primary agent plays as
-        primary_agent_player = (episode % 2) + 1  # 1 for odd episodes, 2 for even
-        is_primary_turn = env.current_player == primary_agent_player
+        primary_agent_player = 1 if player1_only else (episode % 2) + 1  # 1 for odd episodes, 2 for even
+
+        if rollout_batch > 1:
+            if not rollouts:
+                if opponent_snapshot is None:
+                    opponent_snapshot = opponent_agent.snapshot()
+                if next_rollouts is not None:
+                    rollouts.extend(next_rollouts.result())
+                else:
+                    batch_size = min(rollout_batch, episodes - episode)
+                    rollouts.extend(
+                        _play_rollouts(
+                            primary_agent,
+                            opponent_agent,
+                            episode,
+                            batch_size,
+                            env.intermediate_rewards,
+                            rollout_rng,
+                            vector_env=vector_env,
+                            player1_only=player1_only,
+                            opponent_snapshot=opponent_snapshot,
+                        )
+                    )
+                next_rollouts = None
+                next_episode = episode + len(rollouts)
+                if rollout_executor is not None and next_episode < episodes:
+                    next_rollouts = _play_rollouts(
+                        primary_agent,
+                        opponent_agent,
+                        next_episode,
+                        min(rollout_batch, episodes - next_episode),
+                        env.intermediate_rewards,
+                        rollout_rng,
+                        episodes_ahead=len(rollouts),
+                        executor=rollout_executor,
+                        vector_env=vector_env,
+                        player1_only=player1_only,
+                        opponent_snapshot=opponent_snapshot,
+                    )
+            total_reward, winner = _learn_from_rollout(
+                primary_agent, primary_agent_player, not player1_only, *rollouts.popleft()
+            )
+        else:
+            state = env.reset()
+            is_primary_turn = env.current_player == primary_agent_player
 
-        total_reward = 0
-        game_steps = 0
-        actions_taken = []  # Store actions for analysis
+            total_reward = 0
+            game_steps = 0
+            actions_taken = []  # Store actions for analysis
+            render = render_interval > 0 and episode % render_interval == 0  # Decided once per episode
 
-        # Play an episode
-        while not env.done:
-            # Get valid actions
+            # Play an episode; the valid actions after a move are those of the next turn
             valid_actions = env.get_valid_actions()
-
-            if not valid_actions:
-                break
-
-            # Choose an action based on which agent's turn it is
-            if is_primary_turn:  # Primary agent's turn
-                action = primary_agent.get_action(state, valid_actions)
-                actions_taken.append(action)
-            else:  # Opponent agent's turn
-                opp_state = state
-                if primary_agent_player == 1:  # Primary is player 1, convert for player 2
-                    opp_state = _convert_state_for_opponent(state)
-                action = opponent_agent.get_action(opp_state, valid_actions)
-
-            # Take the action
-            next_state, reward, done, info = env.step(action)
-
-            # Get valid actions for next state
-            next_valid_actions = []
-            if not done:
-                next_valid_actions = env.get_valid_actions()
-
-            # Update Q-values for primary agent based on its perspective
-            if is_primary_turn:
-                primary_agent.update(state, action, reward, next_state, next_valid_actions)
-            else:
-                # For opponent's move, we update primary agent with inverted reward
-                if primary_agent_player == 1:  # Primary is player 1
-                    opp_state = _convert_state_for_opponent(state)
-                    opp_next_state = _convert_state_for_opponent(next_state)
-                    primary_agent.update(opp_state, action, -reward, opp_next_state, next_valid_actions)
-                else:  # Primary is player 2
-                    primary_agent.update(state, action, -reward, next_state, next_valid_actions)
-
-            state = next_state
-            total_reward += reward if is_primary_turn else -reward
-            game_steps += 1
-            is_primary_turn = env.current_player == primary_agent_player  # Update turn
-
-            # Render game if requested
-            if render_interval > 0 and episode % render_interval == 0:
-                os.system("clear" if os.name == "posix" else "cls")
-                print(f"Episode: {episode + 1}/{episodes}")
-                print(f"Step: {game_steps}, Player: {env.current_player}")
-                print(f"Primary agent is Player {primary_agent_player}")
-                print(f"Current turn: {'Primary' if is_primary_turn else 'Opponent'}")
-                env.render()
-                time.sleep(0.5)
+            while not env.done and valid_actions:
+                # Choose an action based on which agent's turn it is
+                if is_primary_turn:  # Primary agent's turn
+                    action = primary_agent.get_action(state, valid_actions)
+                    actions_taken.append(action)
+                else:  # Opponent agent's turn
+                    opp_state = state
+                    if primary_agent_player == 1:  # Primary is player 1, convert for player 2
+                        opp_state = swap_players(state)
+                    action = opponent_agent.get_action(opp_state, valid_actions)
+
+                # Take the action
+                next_state, reward, done, _ = env.step(action)
+
+                # Get valid actions for next state
+                next_valid_actions = []
+                if not done:
+                    next_valid_actions = env.get_valid_actions()
+
+                # Update Q-values for primary agent based on its perspective
+                if is_primary_turn:
+                    primary_agent.update(state, action, reward, next_state, next_valid_actions)
+                elif not player1_only:  # With player1_only, only the primary agent's own moves are learned
+                    # For opponent's move, we update primary agent with inverted reward
+                    if primary_agent_player == 1:  # Primary is player 1, opp_state is already swapped
+                        opp_next_state = swap_players(next_state)
+                        primary_agent.update(opp_state, action, -reward, opp_next_state, next_valid_actions)
+                    else:  # Primary is player 2
+                        primary_agent.update(state, action, -reward, next_state, next_valid_actions)
+
+                state = next_state
+                valid_actions = next_valid_actions
+                total_reward += reward if is_primary_turn else -reward
+                game_steps += 1
+                is_primary_turn = env.current_player == primary_agent_player  # Update turn
+
+                # Render game if requested
+                if render:
+                    print(CLEAR_SCREEN, end="")
+                    print(f"Episode: {episode + 1}/{episodes}")
+                    print(f"Step: {game_steps}, Player: {env.current_player}")
+                    print(f"Primary agent is Player {primary_agent_player}")
+                    print(f"Current turn: {'Primary' if is_primary_turn else 'Opponent'}")
+                    env.render()
+                    time.sleep(0.5)
+
+            winner = env.winner
 
         # Record game result based on primary agent's player number
-        primary_agent_won = env.winner == primary_agent_player
-        opponent_agent_won = env.winner is not None and env.winner != primary_agent_player
+        primary_agent_won = winner == primary_agent_player
+        opponent_agent_won = winner is not None and winner != primary_agent_player
 
         if primary_agent_won:
-            primary_wins.append(1)
-            opponent_wins.append(0)
-            draws.append(0)
+            primary_wins[episode] = 1
         elif opponent_agent_won:
-            primary_wins.append(0)
-            opponent_wins.append(1)
-            draws.append(0)
+            opponent_wins[episode] = 1
         else:  # Draw
-            primary_wins.append(0)
-            opponent_wins.append(0)
-            draws.append(1)
+            draws[episode] = 1
 
         # Update ELO rating
-        if env.winner is not None:
-            elo_ratings.append(
-                _update_elo(
-                    elo_ratings[-1],
-                    primary_agent_won,
-                    k_factor=32,
-                )
+        if winner is not None:
+            elo_ratings[episode + 1] = _update_elo(
+                elo_ratings[episode],
+                primary_agent_won,
+                k_factor=32,
             )
         else:
-            elo_ratings.append(elo_ratings[-1])  # No change for draws
+            elo_ratings[episode + 1] = elo_ratings[episode]  # No change for draws
 
         # Record metrics for this episode
-        rewards.append(total_reward)
-        q_table_sizes.append(primary_agent.get_q_table_size())
-        exploration_rates.append(primary_agent.exploration_rate)
+        rewards[episode] = total_reward
+        q_table_sizes[episode] = primary_agent.get_q_table_size()
+        exploration_rates[episode] = primary_agent.exploration_rate
 
         # Decay exploration rate
         primary_agent.decay_exploration()
 
         # Update opponent agent periodically
         if (episode + 1) % opponent_update_interval == 0:
-            opponent_agent = copy.deepcopy(primary_agent)
+            opponent_agent = primary_agent.copy()
+            opponent_snapshot = None
             print(f"\nUpdated opponent agent at episode {episode + 1}")
 
+        # Save JSON for the TypeScript plugin on its own schedule, independent of save_interval
+        if save_json and (episode + 1) % json_interval == 0:
+            # Save from a copy, since the primary agent keeps learning meanwhile
+            json_saves.append(
+                json_executor.submit(
+                    primary_agent.copy().save_qtable_json,
+                    f"dropmind/models/{prefix}qtable_episode_{episode + 1}.json",
+                )
+            )
+
         # Save periodically
         if (episode + 1) % save_interval == 0 or episode == episodes - 1:
-            # Calculate stats
-            recent_rewards = np.mean(rewards[-100:])
-            recent_win_rate = np.mean(primary_wins[-100:])
-            recent_loss_rate = np.mean(opponent_wins[-100:])
-            recent_draw_rate = np.mean(draws[-100:])
-
-            # Save models
-            primary_agent.save_qtable_pickle(f"dropmind/models/qtable_episode_{episode + 1}.pkl")
-            if save_json:
-                primary_agent.save_qtable_json(f"dropmind/models/qtable_episode_{episode + 1}.json")
+            # Calculate stats over the last 100 episodes
+            recent = slice(max(0, episode - 99), episode + 1)
+            recent_rewards = np.mean(rewards[recent])
+            recent_win_rate = np.mean(primary_wins[recent])
+            recent_loss_rate = np.mean(opponent_wins[recent])
+            recent_draw_rate = np.mean(draws[recent])
+
+            # Raise any error of the background JSON saves finished so far, rather than after the run
+            json_saves = check_finished_saves(json_saves)
+
+            # Save models; checkpoints only hold the states changed since the previous one
+            primary_agent.save_qtable_npz(
+                f"dropmind/models/{prefix}qtable_episode_{episode + 1}.npz", changed_only=True
+            )
 
             # Log progress
             elapsed_time = time.time() - start_time
             print(f"\nEpisode {episode + 1} completed in {elapsed_time:.2f} seconds")
             print(f"Q-table size: {primary_agent.get_q_table_size()} states")
-            print(f"Recent primary win rate: {recent_win_rate:.2f}")
-            print(f"Recent opponent win rate: {recent_loss_rate:.2f}")
+            print(f"Recent {primary_label} win rate: {recent_win_rate:.2f}")
+            print(f"Recent {opponent_label} win rate: {recent_loss_rate:.2f}")
             print(f"Recent draw rate: {recent_draw_rate:.2f}")
             print(f"Recent average reward: {recent_rewards:.2f}")
             print(f"Current exploration rate: {primary_agent.exploration_rate:.4f}")
-            print(f"Current ELO rating: {elo_ratings[-1]:.1f}")
+            print(f"Current ELO rating: {elo_ratings[episode + 1]:.1f}")
 
             # Plot metrics
+            played = slice(episode + 1)
             plot_self_play_metrics(
-                episode, rewards, primary_wins, opponent_wins, draws, q_table_sizes, exploration_rates, elo_ratings
+                episode,
+                rewards[played],
+                primary_wins[played],
+                opponent_wins[played],
+                draws[played],
+                q_table_sizes[played],
+                exploration_rates[played],
+                elo_ratings[: episode + 2],
             )
 
-    # Final save
-    primary_agent.save_qtable_pickle("dropmind/models/qtable_final.pkl")
+    if rollout_executor is not None:
+        rollout_executor.shutdown()
+
+    # Final save, before waiting for the background saves so an error there cannot lose it
+    primary_agent.save_qtable_npz(f"dropmind/models/{prefix}qtable_final.npz")
     if save_json:
-        primary_agent.save_qtable_json("dropmind/models/qtable_final.json")
+        primary_agent.save_qtable_json(f"dropmind/models/{prefix}qtable_final.json")
+
+    # Wait for the background JSON saves, raising any error they hit
+    for json_save in json_saves:
+        json_save.result()
+    json_executor.shutdown()
 
     return primary_agent, rewards, primary_wins, opponent_wins, draws, elo_ratings
 
 
-def player1_only_train(
-    episodes=10000,
-    save_interval=1000,
-    learning_rate=0.1,
-    discount_factor=0.95,
-    exploration_rate=1.0,
-    exploration_decay=0.998,
-    min_exploration_rate=0.01,
-    opponent_update_interval=500,
-    save_json=True,
-    render_interval=0,
+def _play_rollouts(
+    primary_agent,
+    opponent_agent,
+    first_episode,
+    batch_size,
+    intermediate_rewards,
+    rng,
+    episodes_ahead=0,
+    executor=None,
+    vector_env=False,
+    player1_only=False,
+    opponent_snapshot=None,
 ):
     """
-    Train the Q-learning agent to play only as player 1.
-    """
-    # Create output directories
-    os.makedirs("./dropmind/models", exist_ok=True)
-    os.makedirs("./dropmind/graphs", exist_ok=True)
+    Play a batch of self-play games in parallel from snapshots of both agents.
 
-    # Initialize environment and agents
-    env = ConnectThreeEnv()
+    Args:
+        primary_agent: Agent that is being trained
+        opponent_agent: Frozen opponent agent
+        first_episode: Episode number of the first game in the batch
+        batch_size: Number of games to play
+        intermediate_rewards: Whether the games use the intermediate pattern rewards
+        rng: NumPy generator used to seed the games
+        episodes_ahead: Number of episodes the primary agent will have finished before
+            the first game of the batch, for its exploration rate
+        executor: Play the games on this executor instead of blocking the caller
+        vector_env: Step the games together on a VecConnectThreeEnv instead of the compiled loop
+        player1_only: Whether the primary agent always plays as player 1
+        opponent_snapshot: Snapshot of the opponent agent to reuse, taken when not given
 
-    # Primary agent (learns as player 1)
-    primary_agent = QLearningAgent(
-        learning_rate=learning_rate,
-        discount_factor=discount_factor,
-        exploration_rate=exploration_rate,
-        exploration_decay=exploration_decay,
-        min_exploration_rate=min_exploration_rate,
+    Returns:
+        List with the recorded (states, actions, rewards, valid_masks, length, winner) of every game,
+        or a future of that list when an executor is given
+    """
+    # Snapshots are taken on the caller's thread, since the agents keep learning meanwhile
+    primary_keys, primary_q = primary_agent.snapshot()
+    opponent_keys, opponent_q = opponent_snapshot or opponent_agent.snapshot()
+
+    # Reproduce the per-episode role alternation and exploration decay of the sequential loop
+    episodes = np.arange(first_episode, first_episode + batch_size)
+    primary_players = np.ones(batch_size, dtype=np.int8) if player1_only else (episodes % 2 + 1).astype(np.int8)
+    exploration_rates = np.maximum(
+        primary_agent.min_exploration_rate,
+        primary_agent.exploration_rate
+        * primary_agent.exploration_decay ** np.arange(episodes_ahead, episodes_ahead + batch_size),
     )
-
-    # Opponent agent (updated periodically from primary agent)
-    opponent_agent = copy.deepcopy(primary_agent)
-
-    # Metrics
-    primary_wins = []
-    opponent_wins = []
-    draws = []
-    rewards = []
-    q_table_sizes = []
-    exploration_rates = []
-    elo_ratings = [1000]  # Starting ELO rating
-
-    start_time = time.time()
-
-    # Training loop
-    for episode in tqdm(range(episodes)):
-        state = env.reset()
-
-        # Primary agent always plays as player 1
-        primary_agent_player = 1
-        is_primary_turn = env.current_player == primary_agent_player
-
-        total_reward = 0
-        game_steps = 0
-        actions_taken = []  # Store actions for analysis
-
-        # Play an episode
-        while not env.done:
-            # Get valid actions
-            valid_actions = env.get_valid_actions()
-
-            if not valid_actions:
-                break
-
-            # Choose an action based on which agent's turn it is
-            if is_primary_turn:  # Primary agent's turn (always player 1)
-                action = primary_agent.get_action(state, valid_actions)
-                actions_taken.append(action)
-            else:  # Opponent agent's turn (always player 2)
-                # Convert state for player 2's perspective
-                opp_state = _convert_state_for_opponent(state)
-                action = opponent_agent.get_action(opp_state, valid_actions)
-
-            # Take the action
-            next_state, reward, done, info = env.step(action)
-
-            # Get valid actions for next state
-            next_valid_actions = []
-            if not done:
-                next_valid_actions = env.get_valid_actions()
-
-            # Update Q-values for primary agent only when it's player 1's turn
-            if is_primary_turn:
-                primary_agent.update(state, action, reward, next_state, next_valid_actions)
-
-            # We don't update the primary agent when it's player 2's turn
-            # This is the key difference - we only learn from player 1's perspective
-
-            state = next_state
-            total_reward += reward if is_primary_turn else -reward
-            game_steps += 1
-            is_primary_turn = env.current_player == primary_agent_player  # Update turn
-
-            # Render game if requested
-            if render_interval > 0 and episode % render_interval == 0:
-                os.system("clear" if os.name == "posix" else "cls")
-                print(f"Episode: {episode + 1}/{episodes}")
-                print(f"Step: {game_steps}, Player: {env.current_player}")
-                print(f"Primary agent is Player {primary_agent_player}")
-                print(f"Current turn: {'Primary' if is_primary_turn else 'Opponent'}")
-                env.render()
-                time.sleep(0.5)
-
-        # Record game result based on primary agent's player number (always 1)
-        primary_agent_won = env.winner == primary_agent_player
-        opponent_agent_won = env.winner is not None and env.winner != primary_agent_player
-
-        if primary_agent_won:
-            primary_wins.append(1)
-            opponent_wins.append(0)
-            draws.append(0)
-        elif opponent_agent_won:
-            primary_wins.append(0)
-            opponent_wins.append(1)
-            draws.append(0)
-        else:  # Draw
-            primary_wins.append(0)
-            opponent_wins.append(0)
-            draws.append(1)
-
-        # Update ELO rating
-        if env.winner is not None:
-            elo_ratings.append(
-                _update_elo(
-                    elo_ratings[-1],
-                    primary_agent_won,
-                    k_factor=32,
+    opponent_exploration_rates = np.full(batch_size, opponent_agent.exploration_rate)
+    seeds = rng.integers(2**31, size=batch_size)
+    play_batch = play_episodes_vec if vector_env else play_episodes
+
+    def play():
+        return list(
+            zip(
+                *play_batch(
+                    primary_keys,
+                    primary_q,
+                    opponent_keys,
+                    opponent_q,
+                    primary_players,
+                    exploration_rates,
+                    opponent_exploration_rates,
+                    seeds,
+                    intermediate_rewards,
                 )
             )
-        else:
-            elo_ratings.append(elo_ratings[-1])  # No change for draws
-
-        # Record metrics for this episode
-        rewards.append(total_reward)
-        q_table_sizes.append(primary_agent.get_q_table_size())
-        exploration_rates.append(primary_agent.exploration_rate)
-
-        # Decay exploration rate
-        primary_agent.decay_exploration()
-
-        # Update opponent agent periodically
-        if (episode + 1) % opponent_update_interval == 0:
-            opponent_agent = copy.deepcopy(primary_agent)
-            print(f"\nUpdated opponent agent at episode {episode + 1}")
-
-        # Save periodically
-        if (episode + 1) % save_interval == 0 or episode == episodes - 1:
-            # Calculate stats
-            recent_rewards = np.mean(rewards[-100:])
-            recent_win_rate = np.mean(primary_wins[-100:])
-            recent_loss_rate = np.mean(opponent_wins[-100:])
-            recent_draw_rate = np.mean(draws[-100:])
-
-            # Save models
-            primary_agent.save_qtable_pickle(f"dropmind/models/player1_qtable_episode_{episode + 1}.pkl")
-            if save_json:
-                primary_agent.save_qtable_json(f"dropmind/models/player1_qtable_episode_{episode + 1}.json")
-
-            # Log progress
-            elapsed_time = time.time() - start_time
-            print(f"\nEpisode {episode + 1} completed in {elapsed_time:.2f} seconds")
-            print(f"Q-table size: {primary_agent.get_q_table_size()} states")
-            print(f"Recent player 1 win rate: {recent_win_rate:.2f}")
-            print(f"Recent player 2 win rate: {recent_loss_rate:.2f}")
-            print(f"Recent draw rate: {recent_draw_rate:.2f}")
-            print(f"Recent average reward: {recent_rewards:.2f}")
-            print(f"Current exploration rate: {primary_agent.exploration_rate:.4f}")
-            print(f"Current ELO rating: {elo_ratings[-1]:.1f}")
-
-            # Plot metrics
-            plot_self_play_metrics(
-                episode, rewards, primary_wins, opponent_wins, draws, q_table_sizes, exploration_rates, elo_ratings
-            )
-
-    # Final save
-    primary_agent.save_qtable_pickle("dropmind/models/player1_qtable_final.pkl")
-    if save_json:
-        primary_agent.save_qtable_json("dropmind/models/player1_qtable_final.json")
+        )
 
-    return primary_agent, rewards, primary_wins, opponent_wins, draws, elo_ratings
+    if executor is None:
+        return play()
+    return executor.submit(play)
 
 
-def _convert_state_for_opponent(state):
+def _learn_from_rollout(
+    primary_agent, primary_agent_player, learn_opponent_moves, states, actions, rewards, valid_masks, length, winner
+):
     """
-    Convert a state representation to the opponent's perspective.
+    Update the primary agent from one recorded game, the same way the sequential loop does.
 
-    In Connect Three, we need to swap the player numbers (1 and 2)
-    to allow the agent to learn from both perspectives.
-
-    Since the primary agent is now player 2, this function is used
-    to convert states for the opponent (player 1).
+    Returns:
+        The primary agent's total reward and the winner of the game (None for a draw)
     """
-    # Convert string to list for easy manipulation
-    state_list = list(state)
-
-    # Swap 1s and 2s: replace 1 with 'x', 2 with 1, then 'x' with 2
-    for i in range(len(state_list)):
-        if state_list[i] == "1":
-            state_list[i] = "x"  # Temporary placeholder
-        elif state_list[i] == "2":
-            state_list[i] = "1"
+    # Players alternate every move, since the agents never pick a full column
+    primary_turns = np.arange(length) % 2 + 1 == primary_agent_player
+    # The primary agent learns from the opponent's moves with inverted rewards
+    rewards = np.where(primary_turns, rewards[:length], -rewards[:length])
+    states, next_states = states[:length], states[1 : length + 1]
+    if primary_agent_player == 1:
+        # The opponent played as player 2, so its moves are learned with the players swapped
+        states = np.where(primary_turns, states, swap_players(states))
+        next_states = np.where(primary_turns, next_states, swap_players(next_states))
+    next_valid_masks = valid_masks[1 : length + 1].copy()
+    next_valid_masks[-1] = 0  # No next actions after the final move
+
+    learned = slice(None) if learn_opponent_moves else primary_turns
+    primary_agent.update_batch(
+        states[learned], actions[:length][learned], rewards[learned], next_states[learned], next_valid_masks[learned]
+    )
+    return float(rewards.sum()), int(winner) or None
 
-    for i in range(len(state_list)):
-        if state_list[i] == "x":
-            state_list[i] = "2"
 
-    # Convert back to string
-    return "".join(state_list)
+# 10 ** (x / 400) == exp(x * ln(10) / 400)
+_ELO_EXPONENT = math.log(10) / 400
 
 
 def _update_elo(current_elo, won, k_factor=32):
@@ -426,8 +430,8 @@ def _update_elo(current_elo, won, k_factor=32):
     # we can use a fixed opponent rating of 1000
     opponent_elo = 1000
 
-    # Calculate expected score
-    expected = 1 / (1 + 10 ** ((opponent_elo - current_elo) / 400))
+    # Calculate expected score, 1 / (1 + 10 ** ((opponent_elo - current_elo) / 400)) written with one exp
+    expected = 1.0 / (1.0 + math.exp((opponent_elo - float(current_elo)) * _ELO_EXPONENT))
 
     # Calculate actual score
     actual = 1.0 if won else 0.0
@@ -438,79 +442,90 @@ def _update_elo(current_elo, won, k_factor=32):
     return new_elo
 
 
+# Figure reused by every plot_self_play_metrics call, created on first use. A plain Figure
+# rather than pyplot renders straight to PNG with Agg, without a GUI backend
+_FIG = None
+_AXES = None
+
+
 def plot_self_play_metrics(
     episode, rewards, primary_wins, opponent_wins, draws, q_table_sizes, exploration_rates, elo_ratings
 ):
     """Plot training metrics for self-play."""
-    plt.figure(figsize=(15, 12))
+    global _FIG, _AXES
+    if _FIG is None:
+        _FIG = Figure(figsize=(15, 12))
+        _AXES = _FIG.subplots(3, 2)
+    for ax in _AXES.flat:
+        ax.cla()
 
     # Calculate window size for moving averages
     window_size = min(100, len(rewards))
+    # Running totals of the rewards and outcomes, starting with a row of zeros
+    totals = np.zeros((len(rewards) + 1, 4))
+    np.cumsum(np.column_stack((rewards, primary_wins, opponent_wins, draws)), axis=0, out=totals[1:])
 
     # Plot rewards
-    plt.subplot(3, 2, 1)
-    plt.plot(rewards)
-    plt.plot(np.convolve(rewards, np.ones(window_size) / window_size, mode="valid"))
-    plt.title("Rewards per Episode")
-    plt.xlabel("Episode")
-    plt.ylabel("Total Reward")
+    ax = _AXES[0, 0]
+    ax.plot(rewards)
+    ax.plot(window_average(totals[:, 0], window_size))
+    ax.set_title("Rewards per Episode")
+    ax.set_xlabel("Episode")
+    ax.set_ylabel("Total Reward")
 
     # Plot win rates
-    plt.subplot(3, 2, 2)
-    primary_win_rate = np.convolve(primary_wins, np.ones(window_size) / window_size, mode="valid")
-    opponent_win_rate = np.convolve(opponent_wins, np.ones(window_size) / window_size, mode="valid")
-    draw_rate = np.convolve(draws, np.ones(window_size) / window_size, mode="valid")
-
-    plt.plot(primary_win_rate, label="Primary Agent")
-    plt.plot(opponent_win_rate, label="Opponent Agent")
-    plt.plot(draw_rate, label="Draws")
-    plt.title("Outcome Rates (Moving Average)")
-    plt.xlabel("Episode")
-    plt.ylabel("Rate")
-    plt.ylim(0, 1)
-    plt.legend()
+    ax = _AXES[0, 1]
+    primary_win_rate = window_average(totals[:, 1], window_size)
+    opponent_win_rate = window_average(totals[:, 2], window_size)
+    draw_rate = window_average(totals[:, 3], window_size)
+
+    ax.plot(primary_win_rate, label="Primary Agent")
+    ax.plot(opponent_win_rate, label="Opponent Agent")
+    ax.plot(draw_rate, label="Draws")
+    ax.set_title("Outcome Rates (Moving Average)")
+    ax.set_xlabel("Episode")
+    ax.set_ylabel("Rate")
+    ax.set_ylim(0, 1)
+    ax.legend()
 
     # Plot game outcomes
-    plt.subplot(3, 2, 3)
-    outcomes = np.array([primary_wins, opponent_wins, draws]).T
-    if len(outcomes) > 0:
-        cumulative_outcomes = np.cumsum(outcomes, axis=0)
-        plt.stackplot(
-            range(len(cumulative_outcomes)),
-            [cumulative_outcomes[:, 0], cumulative_outcomes[:, 1], cumulative_outcomes[:, 2]],
+    ax = _AXES[1, 0]
+    if len(rewards) > 0:
+        ax.stackplot(
+            range(len(rewards)),
+            totals[1:, 1:].T,
             labels=["Primary Wins", "Opponent Wins", "Draws"],
             colors=["green", "red", "blue"],
         )
-        plt.legend(loc="upper left")
-        plt.title("Cumulative Game Outcomes")
-        plt.xlabel("Episode")
-        plt.ylabel("Count")
+        ax.legend(loc="upper left")
+        ax.set_title("Cumulative Game Outcomes")
+        ax.set_xlabel("Episode")
+        ax.set_ylabel("Count")
 
     # Plot Q-table size
-    plt.subplot(3, 2, 4)
-    plt.plot(q_table_sizes)
-    plt.title("Q-table Size Growth")
-    plt.xlabel("Episode")
-    plt.ylabel("Number of States")
+    ax = _AXES[1, 1]
+    ax.plot(q_table_sizes)
+    ax.set_title("Q-table Size Growth")
+    ax.set_xlabel("Episode")
+    ax.set_ylabel("Number of States")
 
     # Plot exploration rate
-    plt.subplot(3, 2, 5)
-    plt.plot(exploration_rates)
-    plt.title("Exploration Rate Decay")
-    plt.xlabel("Episode")
-    plt.ylabel("Epsilon")
-    plt.ylim(0, 1)
+    ax = _AXES[2, 0]
+    ax.plot(exploration_rates)
+    ax.set_title("Exploration Rate Decay")
+    ax.set_xlabel("Episode")
+    ax.set_ylabel("Epsilon")
+    ax.set_ylim(0, 1)
 
     # Plot ELO rating
-    plt.subplot(3, 2, 6)
-    plt.plot(elo_ratings)
-    plt.title("ELO Rating Progression")
-    plt.xlabel("Episode")
-    plt.ylabel("ELO Rating")
+    ax = _AXES[2, 1]
+    ax.plot(elo_ratings)
+    ax.set_title("ELO Rating Progression")
+    ax.set_xlabel("Episode")
+    ax.set_ylabel("ELO Rating")
 
-    plt.tight_layout()
-    plt.savefig(f"dropmind/graphs/self_play_progress_episode_{episode + 1}.png")
-    plt.close()
+    _FIG.tight_layout()
+    _FIG.savefig(f"dropmind/graphs/self_play_progress_episode_{episode + 1}.png")
 
 
 if __name__ == "__main__":
@@ -525,35 +540,43 @@ if __name__ == "__main__":
     parser.add_argument("--min-exploration-rate", type=float, default=0.01, help="Minimum exploration rate")
     parser.add_argument("--opponent-update", type=int, default=200, help="Update opponent every X episodes")
     parser.add_argument("--no-json", action="store_false", dest="save_json", help="Do not save in JSON format")
+    parser.add_argument(
+        "--json-interval",
+        type=int,
+        default=None,
+        help="Save in JSON format every X episodes (default 10x the save interval)",
+    )
     parser.add_argument("--render", type=int, default=0, help="Render every X episodes (0 for no rendering)")
     parser.add_argument("--player1-only", action="store_true", help="Train only as player 1")
+    parser.add_argument(
+        "--rollout-batch", type=int, default=1, help="Play X games in parallel per batch (1 to play sequentially)"
+    )
+    parser.add_argument(
+        "--overlap-rollouts",
+        action="store_true",
+        help="Play the next rollout batch in the background while learning from the current one",
+    )
+    parser.add_argument(
+        "--vector-env",
+        action="store_true",
+        help="Step each rollout batch together on the vectorized environment",
+    )
     args = parser.parse_args()
 
-    # Choose training function based on arguments
-    if args.player1_only:
-        player1_only_train(
-            episodes=args.episodes,
-            save_interval=args.save_interval,
-            learning_rate=args.learning_rate,
-            discount_factor=args.discount_factor,
-            exploration_rate=args.exploration_rate,
-            exploration_decay=args.exploration_decay,
-            min_exploration_rate=args.min_exploration_rate,
-            opponent_update_interval=args.opponent_update,
-            save_json=args.save_json,
-            render_interval=args.render,
-        )
-    else:
-        # Original self-play training
-        self_play_train(
-            episodes=args.episodes,
-            save_interval=args.save_interval,
-            learning_rate=args.learning_rate,
-            discount_factor=args.discount_factor,
-            exploration_rate=args.exploration_rate,
-            exploration_decay=args.exploration_decay,
-            min_exploration_rate=args.min_exploration_rate,
-            opponent_update_interval=args.opponent_update,
-            save_json=args.save_json,
-            render_interval=args.render,
-        )
+    self_play_train(
+        episodes=args.episodes,
+        save_interval=args.save_interval,
+        learning_rate=args.learning_rate,
+        discount_factor=args.discount_factor,
+        exploration_rate=args.exploration_rate,
+        exploration_decay=args.exploration_decay,
+        min_exploration_rate=args.min_exploration_rate,
+        opponent_update_interval=args.opponent_update,
+        save_json=args.save_json,
+        json_interval=args.json_interval,
+        render_interval=args.render,
+        rollout_batch=args.rollout_batch,
+        overlap_rollouts=args.overlap_rollouts,
+        vector_env=args.vector_env,
+        player1_only=args.player1_only,
+    )
@@ -1,12 +1,16 @@
 import argparse
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-import matplotlib.pyplot as plt
 import numpy as np
 from agent import QLearningAgent
-from environment import ConnectThreeEnv
+from environment import CLEAR_SCREEN, ConnectThreeEnv
+from matplotlib.figure import Figure
+from rollout import play_episodes
 from tqdm import tqdm
+from training_utils import check_finished_saves, window_average
+from vec_environment import VecConnectThreeEnv
 
 
 def train(
@@ -18,11 +22,27 @@ def train(
     exploration_decay=0.995,
     min_exploration_rate=0.01,
     save_json=True,
+    json_interval=None,
     render_interval=0,
+    num_envs=1,
+    rollout_batch=1,
 ):
     """
     Train the Q-learning agent.
 
+    With num_envs > 1, that many games are played at once on a VecConnectThreeEnv: the
+    agent picks the moves of all games in one batch and learns from them in one batch
+    update per step.
+
+    With rollout_batch > 1, games are played in batches of that size by the compiled game
+    loop (see rollout.play_episodes) from a snapshot of the agent taken at the start of each
+    batch, and the agent learns from every game afterwards. Within a game no state comes up
+    twice, so each game is played exactly as the agent would have played it move by move;
+    only the later games of a batch miss the updates of the earlier ones. It cannot be
+    combined with num_envs > 1.
+
+    Rendering is only available when playing one game at a time.
+
     Args:
         episodes: Number of episodes to train
         save_interval: Save model every X episodes
@@ -32,13 +52,24 @@ def train(
         exploration_decay: Rate at which exploration decreases
         min_exploration_rate: Minimum exploration rate
         save_json: Whether to also save in JSON format for TypeScript
+        json_interval: Save JSON every X episodes (default 10 * save_interval); the final model is always saved
         render_interval: If > 0, render the game every X episodes
+        num_envs: Number of games to play at once
+        rollout_batch: Number of games to play from one snapshot of the agent with the compiled game loop
     """
-    # Create output directory
+    # JSON checkpoints are slow to write and only needed for the TypeScript plugin, so fewer of them
+    if json_interval is None:
+        json_interval = save_interval * 10
+    if json_interval <= 0:
+        raise ValueError(f"json_interval must be positive, got {json_interval}")
+    if rollout_batch > 1 and num_envs > 1:
+        raise ValueError(f"Choose either rollout_batch or num_envs, got {rollout_batch} and {num_envs}")
+
+    # Create output directories
     os.makedirs("./dropmind/models", exist_ok=True)
+    os.makedirs("./dropmind/graphs", exist_ok=True)
 
-    # Initialize environment and agent
-    env = ConnectThreeEnv()
+    # Initialize agent
     agent = QLearningAgent(
         learning_rate=learning_rate,
         discount_factor=discount_factor,
@@ -48,176 +79,353 @@ def train(
     )
 
     # Metrics
-    wins = []
-    losses = []
-    draws = []
-    rewards = []
-    invalid_moves = []
-    q_table_sizes = []
-    exploration_rates = []
+    wins = np.zeros(episodes, dtype=np.int8)
+    losses = np.zeros(episodes, dtype=np.int8)
+    draws = np.zeros(episodes, dtype=np.int8)
+    rewards = np.zeros(episodes, dtype=np.float32)
+    # Running totals up to every episode, after a zero row for before the first, kept up to date
+    # so the plots take moving averages and cumulative outcomes without summing everything again
+    cumulative_rewards = np.zeros(episodes + 1)
+    cumulative_outcomes = np.zeros((episodes + 1, 3), dtype=np.int64)  # Wins, losses, draws
+    invalid_moves = np.zeros(episodes, dtype=np.int64)
+    q_table_sizes = np.zeros(episodes, dtype=np.int64)
+    exploration_rates = np.zeros(episodes, dtype=np.float32)
 
     start_time = time.time()
 
+    # Periodic JSON checkpoints and plots are written on a background thread while training continues
+    io_executor = ThreadPoolExecutor(max_workers=1)
+    io_saves = []
+
+    # Games are played by a generator, so the agent decays and saves between episodes either way
+    if rollout_batch > 1:
+        games = _play_rollouts(agent, episodes, rollout_batch)
+    elif num_envs > 1:
+        games = _play_batched(agent, episodes, num_envs)
+    else:
+        games = _play_sequential(agent, episodes, render_interval)
+
     # Training loop
-    for episode in tqdm(range(episodes)):
+    for episode, (total_reward, winner, invalid_move_count) in enumerate(
+        tqdm(games, total=episodes, mininterval=1.0, miniters=max(1, episodes // 1000), smoothing=0.1)
+    ):
+        # Record game result
+        if winner == 1:
+            wins[episode] = 1
+            outcome = 0
+        elif winner == 2:
+            losses[episode] = 1
+            outcome = 1
+        else:  # Draw
+            draws[episode] = 1
+            outcome = 2
+
+        # Record metrics for this episode
+        rewards[episode] = total_reward
+        cumulative_rewards[episode + 1] = cumulative_rewards[episode] + total_reward
+        cumulative_outcomes[episode + 1] = cumulative_outcomes[episode]
+        cumulative_outcomes[episode + 1, outcome] += 1
+        invalid_moves[episode] = invalid_move_count
+        q_table_sizes[episode] = agent.get_q_table_size()
+        exploration_rates[episode] = agent.exploration_rate
+
+        # Decay exploration rate
+        agent.decay_exploration()
+
+        # Save JSON for the TypeScript plugin on its own schedule, independent of save_interval
+        if save_json and (episode + 1) % json_interval == 0:
+            # Save from a copy, since the agent keeps learning meanwhile
+            io_saves.append(
+                io_executor.submit(agent.copy().save_qtable_json, f"dropmind/models/qtable_episode_{episode + 1}.json")
+            )
+
+        # Save periodically
+        if (episode + 1) % save_interval == 0 or episode == episodes - 1:
+            # Calculate stats over the last 100 episodes, from differences of the running totals
+            first = max(0, episode - 99)
+            recent_rewards = (cumulative_rewards[episode + 1] - cumulative_rewards[first]) / (episode + 1 - first)
+            recent_win_rate, recent_loss_rate, recent_draw_rate = (
+                cumulative_outcomes[episode + 1] - cumulative_outcomes[first]
+            ) / (episode + 1 - first)
+
+            # Raise any error of the background saves finished so far, rather than after the run
+            io_saves = check_finished_saves(io_saves)
+
+            # Save models; checkpoints only hold the states changed since the previous one
+            agent.save_qtable_npz(f"dropmind/models/qtable_episode_{episode + 1}.npz", changed_only=True)
+
+            # Log progress
+            elapsed_time = time.time() - start_time
+            print(f"\nEpisode {episode + 1} completed in {elapsed_time:.2f} seconds")
+            print(f"Q-table size: {agent.get_q_table_size()} states")
+            print(f"Recent win rate: {recent_win_rate:.2f}")
+            print(f"Recent loss rate: {recent_loss_rate:.2f}")
+            print(f"Recent draw rate: {recent_draw_rate:.2f}")
+            print(f"Recent average reward: {recent_rewards:.2f}")
+            print(f"Current exploration rate: {agent.exploration_rate:.4f}")
+
+            # Plot metrics in the background. Later episodes only write past these slices,
+            # so they can be plotted without copying
+            io_saves.append(
+                io_executor.submit(
+                    plot_metrics,
+                    episode,
+                    rewards[: episode + 1],
+                    cumulative_rewards[: episode + 2],
+                    cumulative_outcomes[: episode + 2],
+                    q_table_sizes[: episode + 1],
+                    exploration_rates[: episode + 1],
+                )
+            )
+
+    # Final save, before waiting for the background saves so an error there cannot lose it
+    agent.save_qtable_npz("dropmind/models/qtable_final.npz")
+    if save_json:
+        agent.save_qtable_json("dropmind/models/qtable_final.json")
+
+    # Wait for the background saves, raising any error they hit
+    for io_save in io_saves:
+        io_save.result()
+    io_executor.shutdown()
+
+    return agent, rewards, wins, losses, draws
+
+
+def _play_sequential(agent, episodes, render_interval):
+    """
+    Play episodes one at a time, updating the agent from every episode in one batch when it ends.
+
+    No state comes up twice within a game, so the moves are chosen exactly as with an update
+    after every move, and update_batch applies the updates in the same order.
+
+    Yields:
+        The total reward, winner (None for a draw) and number of invalid moves of every episode
+    """
+    env = ConnectThreeEnv()
+    for episode in range(episodes):
         state = env.reset()
         total_reward = 0
         game_steps = 0
         invalid_move_count = 0
+        render = render_interval > 0 and episode % render_interval == 0  # Decided once per episode
+        # Transitions of the episode, learned from when it ends
+        states, actions, rewards, next_states, next_valid_masks = [], [], [], [], []
 
-        # Play an episode
-        while not env.done:
-            # Get valid actions
-            valid_actions = env.get_valid_actions()
-
-            if not valid_actions:
-                break
-
+        # Play an episode; the valid actions after a move are those of the next turn
+        valid_actions = env.get_valid_actions()
+        while not env.done and valid_actions:
             # Choose an action
             action = agent.get_action(state, valid_actions)
 
             # Take the action
-            next_state, reward, done, info = env.step(action)
-
-            # Count invalid moves
-            if info.get("invalid_move", False):
-                invalid_move_count += 1
+            next_state, reward, done, invalid = env.step(action)
+            invalid_move_count += invalid  # Count invalid moves
 
             # Get valid actions for next state
             next_valid_actions = []
             if not done:
                 next_valid_actions = env.get_valid_actions()
 
-            # Update Q-values
-            agent.update(state, action, reward, next_state, next_valid_actions)
+            # Record the transition for the Q-value update
+            states.append(state)
+            actions.append(action)
+            rewards.append(reward)
+            next_states.append(next_state)
+            next_valid_masks.append(sum(1 << a for a in next_valid_actions))
 
             state = next_state
+            valid_actions = next_valid_actions
             total_reward += reward
             game_steps += 1
 
             # Render game if requested
-            if render_interval > 0 and episode % render_interval == 0:
-                os.system("clear" if os.name == "posix" else "cls")
+            if render:
+                print(CLEAR_SCREEN, end="")
                 print(f"Episode: {episode + 1}/{episodes}")
                 print(f"Step: {game_steps}, Player: {env.current_player}")
                 env.render()
                 time.sleep(0.5)  # Pause to make rendering visible
 
-        # Record game result
-        if env.winner == 1:
-            wins.append(1)
-            losses.append(0)
-            draws.append(0)
-        elif env.winner == 2:
-            wins.append(0)
-            losses.append(1)
-            draws.append(0)
-        else:  # Draw
-            wins.append(0)
-            losses.append(0)
-            draws.append(1)
-
-        # Record metrics for this episode
-        rewards.append(total_reward)
-        invalid_moves.append(invalid_move_count)
-        q_table_sizes.append(agent.get_q_table_size())
-        exploration_rates.append(agent.exploration_rate)
-
-        # Decay exploration rate
-        agent.decay_exploration()
+        # Update Q-values
+        agent.update_batch(
+            np.array(states, dtype=np.int64),
+            np.array(actions),
+            np.array(rewards),
+            np.array(next_states, dtype=np.int64),
+            np.array(next_valid_masks),
+        )
 
-        # Save periodically
-        if (episode + 1) % save_interval == 0 or episode == episodes - 1:
-            # Calculate stats
-            recent_rewards = np.mean(rewards[-100:])
-            recent_win_rate = np.mean(wins[-100:])
-            recent_loss_rate = np.mean(losses[-100:])
-            recent_draw_rate = np.mean(draws[-100:])
+        yield total_reward, env.winner, invalid_move_count
 
-            # Save models
-            agent.save_qtable_pickle(f"dropmind/models/qtable_episode_{episode + 1}.pkl")
-            if save_json:
-                agent.save_qtable_json(f"dropmind/models/qtable_episode_{episode + 1}.json")
 
-            # Log progress
-            elapsed_time = time.time() - start_time
-            print(f"\nEpisode {episode + 1} completed in {elapsed_time:.2f} seconds")
-            print(f"Q-table size: {agent.get_q_table_size()} states")
-            print(f"Recent win rate: {recent_win_rate:.2f}")
-            print(f"Recent loss rate: {recent_loss_rate:.2f}")
-            print(f"Recent draw rate: {recent_draw_rate:.2f}")
-            print(f"Recent average reward: {recent_rewards:.2f}")
-            print(f"Current exploration rate: {agent.exploration_rate:.4f}")
+def _play_rollouts(agent, episodes, rollout_batch):
+    """
+    Play episodes in batches with the compiled game loop, the agent playing both sides.
 
-            # Plot metrics
-            plot_metrics(episode, rewards, wins, losses, draws, q_table_sizes, exploration_rates)
+    Yields:
+        The total reward, winner (None for a draw) and number of invalid moves of every episode
+    """
+    rng = np.random.default_rng()
+    intermediate_rewards = ConnectThreeEnv().intermediate_rewards
+    for first_episode in range(0, episodes, rollout_batch):
+        batch_size = min(rollout_batch, episodes - first_episode)
+        keys, q = agent.snapshot()
+        # Reproduce the exploration decay after every episode of the sequential loop
+        exploration_rates = np.maximum(
+            agent.min_exploration_rate, agent.exploration_rate * agent.exploration_decay ** np.arange(batch_size)
+        )
+        states, actions, rewards, valid_masks, lengths, winners = play_episodes(
+            keys,
+            q,
+            keys,
+            q,
+            np.ones(batch_size, dtype=np.int8),
+            exploration_rates,
+            exploration_rates,
+            rng.integers(2**31, size=batch_size),
+            intermediate_rewards,
+            False,
+        )
 
-    # Final save
-    agent.save_qtable_pickle("dropmind/models/qtable_final.pkl")
-    if save_json:
-        agent.save_qtable_json("dropmind/models/qtable_final.json")
+        for game, length in enumerate(lengths.tolist()):
+            next_valid_masks = valid_masks[game, 1 : length + 1].copy()
+            next_valid_masks[-1] = 0  # No next actions after the final move
+            agent.update_batch(
+                states[game, :length],
+                actions[game, :length],
+                rewards[game, :length],
+                states[game, 1 : length + 1],
+                next_valid_masks,
+            )
+            # The compiled loop only plays valid columns
+            yield float(rewards[game, :length].sum()), int(winners[game]) or None, 0
+
+
+def _play_batched(agent, episodes, num_envs):
+    """
+    Play episodes num_envs at a time on a VecConnectThreeEnv, updating the agent after every batch of moves.
 
-    return agent, rewards, wins, losses, draws
+    A finished game starts the next episode right away, until all episodes are started.
 
+    Yields:
+        The total reward, winner (None for a draw) and number of invalid moves of every episode, in the
+        order they finish
+    """
+    num_envs = min(num_envs, episodes)
+    env = VecConnectThreeEnv(num_envs)
+    states = env.reset()
+    column_bits = 1 << np.arange(5)
+    total_rewards = np.zeros(num_envs)
+    invalid_moves = np.zeros(num_envs, dtype=np.int64)
+    running = np.ones(num_envs, dtype=bool)  # Games playing an episode that is not finished yet
+    started = num_envs
+
+    actions = np.zeros(num_envs, dtype=np.int64)
+    while running.any():
+        # Only the games still playing choose a move, so the final states of games that are not
+        # restarted are never looked up (and added to the Q-table); the environment leaves them as they are
+        games = np.flatnonzero(running)
+        actions[games] = agent.get_actions(states[games], env.get_valid_actions()[games])
+        next_states, rewards, dones = env.step(actions)
+
+        # Learn from the games that are still playing, in game order; finished games have no next actions
+        next_valid_masks = np.where(dones, 0, env.get_valid_actions() @ column_bits)
+        agent.update_batch(states[games], actions[games], rewards[games], next_states[games], next_valid_masks[games])
+        total_rewards += rewards
+        invalid_moves += rewards == -10.0  # The reward for a move into a full column
+
+        finished = np.flatnonzero(running & dones)
+        for game in finished.tolist():
+            yield float(total_rewards[game]), int(env.winner[game]) or None, int(invalid_moves[game])
+
+        # Start the next episodes in the finished games
+        restart = finished[: episodes - started]
+        started += len(restart)
+        running[finished[len(restart) :]] = False
+        total_rewards[restart] = 0.0
+        invalid_moves[restart] = 0
+        reset = np.zeros(num_envs, dtype=bool)
+        reset[restart] = True
+        states = env.reset(reset)
+
+
+# Figure and axes reused by every plot_metrics call, created on first use. Plots are drawn
+# one at a time on the background I/O thread, so they never share it
+_FIG = None
+_AXES = None
+
+
+def plot_metrics(episode, rewards, cumulative_rewards, cumulative_outcomes, q_table_sizes, exploration_rates):
+    """
+    Plot training metrics.
 
-def plot_metrics(episode, rewards, wins, losses, draws, q_table_sizes, exploration_rates):
-    """Plot training metrics."""
-    plt.figure(figsize=(15, 10))
+    Args:
+        episode: Index of the last episode played
+        rewards: Total reward of every episode
+        cumulative_rewards: Running total of the rewards, starting with a 0 before the first episode
+        cumulative_outcomes: Running counts of wins, losses and draws, starting with a row of zeros
+        q_table_sizes: Q-table size after every episode
+        exploration_rates: Exploration rate of every episode
+    """
+    # A plain Figure rather than pyplot's global state, so plots can be drawn on a background thread
+    global _FIG, _AXES
+    if _FIG is None:
+        _FIG = Figure(figsize=(15, 10))
+        _AXES = [_FIG.add_subplot(2, 3, k) for k in range(1, 6)]
+    for ax in _AXES:
+        ax.cla()
 
     # Calculate window size for moving averages
     window_size = min(100, len(rewards))
 
     # Plot rewards
-    plt.subplot(2, 3, 1)
-    plt.plot(rewards)
-    plt.plot(np.convolve(rewards, np.ones(window_size) / window_size, mode="valid"))
-    plt.title("Rewards per Episode")
-    plt.xlabel("Episode")
-    plt.ylabel("Total Reward")
+    ax = _AXES[0]
+    ax.plot(rewards)
+    ax.plot(window_average(cumulative_rewards, window_size))
+    ax.set_title("Rewards per Episode")
+    ax.set_xlabel("Episode")
+    ax.set_ylabel("Total Reward")
 
     # Plot win rate
-    plt.subplot(2, 3, 2)
-    win_rate = np.convolve(wins, np.ones(window_size) / window_size, mode="valid")
-    plt.plot(win_rate)
-    plt.title("Win Rate (Moving Average)")
-    plt.xlabel("Episode")
-    plt.ylabel("Win Rate")
-    plt.ylim(0, 1)
+    ax = _AXES[1]
+    win_rate = window_average(cumulative_outcomes[:, 0], window_size)
+    ax.plot(win_rate)
+    ax.set_title("Win Rate (Moving Average)")
+    ax.set_xlabel("Episode")
+    ax.set_ylabel("Win Rate")
+    ax.set_ylim(0, 1)
 
     # Plot game outcomes
-    plt.subplot(2, 3, 3)
-    outcomes = np.array([wins, losses, draws]).T
-    if len(outcomes) > 0:
-        cumulative_outcomes = np.cumsum(outcomes, axis=0)
-        plt.stackplot(
-            range(len(cumulative_outcomes)),
-            [cumulative_outcomes[:, 0], cumulative_outcomes[:, 1], cumulative_outcomes[:, 2]],
+    ax = _AXES[2]
+    if len(rewards) > 0:
+        ax.stackplot(
+            range(len(rewards)),
+            cumulative_outcomes[1:].T,
             labels=["Wins", "Losses", "Draws"],
             colors=["green", "red", "blue"],
         )
-        plt.legend(loc="upper left")
-        plt.title("Cumulative Game Outcomes")
-        plt.xlabel("Episode")
-        plt.ylabel("Count")
+        ax.legend(loc="upper left")
+        ax.set_title("Cumulative Game Outcomes")
+        ax.set_xlabel("Episode")
+        ax.set_ylabel("Count")
 
     # Plot Q-table size
-    plt.subplot(2, 3, 4)
-    plt.plot(q_table_sizes)
-    plt.title("Q-table Size Growth")
-    plt.xlabel("Episode")
-    plt.ylabel("Number of States")
+    ax = _AXES[3]
+    ax.plot(q_table_sizes)
+    ax.set_title("Q-table Size Growth")
+    ax.set_xlabel("Episode")
+    ax.set_ylabel("Number of States")
 
     # Plot exploration rate
-    plt.subplot(2, 3, 5)
-    plt.plot(exploration_rates)
-    plt.title("Exploration Rate Decay")
-    plt.xlabel("Episode")
-    plt.ylabel("Epsilon")
-    plt.ylim(0, 1)
+    ax = _AXES[4]
+    ax.plot(exploration_rates)
+    ax.set_title("Exploration Rate Decay")
+    ax.set_xlabel("Episode")
+    ax.set_ylabel("Epsilon")
+    ax.set_ylim(0, 1)
 
-    plt.tight_layout()
-    plt.savefig(f"dropmind/graphs/training_progress_episode_{episode + 1}.png")
-    plt.close()
+    _FIG.tight_layout()
+    _FIG.savefig(f"dropmind/graphs/training_progress_episode_{episode + 1}.png")
 
 
 if __name__ == "__main__":
@@ -231,7 +439,20 @@ if __name__ == "__main__":
     parser.add_argument("--exploration-decay", type=float, default=0.995, help="Exploration decay rate")
     parser.add_argument("--min-exploration-rate", type=float, default=0.01, help="Minimum exploration rate")
     parser.add_argument("--no-json", action="store_false", dest="save_json", help="Do not save in JSON format")
+    parser.add_argument(
+        "--json-interval",
+        type=int,
+        default=None,
+        help="Save in JSON format every X episodes (default 10x the save interval)",
+    )
     parser.add_argument("--render", type=int, default=0, help="Render every X episodes (0 for no rendering)")
+    parser.add_argument("--num-envs", type=int, default=1, help="Play X games at once (1 to play one at a time)")
+    parser.add_argument(
+        "--rollout-batch",
+        type=int,
+        default=1,
+        help="Play X games per batch with the compiled game loop (not combined with --num-envs)",
+    )
     args = parser.parse_args()
 
     # Train the agent
@@ -244,5 +465,8 @@ if __name__ == "__main__":
         exploration_decay=args.exploration_decay,
         min_exploration_rate=args.min_exploration_rate,
         save_json=args.save_json,
+        json_interval=args.json_interval,
         render_interval=args.render,
+        num_envs=args.num_envs,
+        rollout_batch=args.rollout_batch,
     )
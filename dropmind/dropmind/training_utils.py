@@ -0,0 +1,19 @@
+def check_finished_saves(futures):
+    """Raise the error of any finished background save, and return the saves still running."""
+    running = []
+    for future in futures:
+        if future.done():
+            future.result()
+        else:
+            running.append(future)
+    return running
+
+
+def window_average(cumulative, window_size):
+    """
+    Moving average over full windows from running totals that start with a 0.
+
+    Like np.convolve(values, np.ones(w) / w, mode="valid") on the values summed up, but
+    differences of the running totals take O(N) instead of O(N * w).
+    """
+    return (cumulative[window_size:] - cumulative[:-window_size]) / window_size
@@ -0,0 +1,279 @@
+from functools import lru_cache
+
+import numpy as np
+from environment import (
+    _LINE_ATTACK,
+    _LINE_BLOCK,
+    _LINE_GRAVITY,
+    CENTER_BOTTOM,
+    CENTER_COLUMN,
+    LINE_CELLS,
+    MIDDLE_COLUMNS,
+)
+
+try:
+    import cupy
+except ImportError:  # Optional, only needed to run the batch on a GPU
+    cupy = None
+
+# Winning lines as flat indices (r * 5 + c) into a 15-cell board, one row per line
+LINE_INDEX = np.array([[r * 5 + c for r, c in cells] for cells in LINE_CELLS], dtype=np.intp)
+
+
+def _cells(mask):
+    """Convert a bitboard mask to the flat indices of its cells."""
+    return np.array([cell for cell in range(15) if mask >> cell & 1], dtype=np.intp)
+
+
+def _weight_groups(weights):
+    """Group line indices by weight; the line weights take only a few distinct values."""
+    return tuple((float(weight), np.flatnonzero(weights == weight)) for weight in np.unique(weights))
+
+
+class _Tables:
+    """Line and position tables as arrays of one array module, so NumPy and CuPy boards index them directly."""
+
+    def __init__(self, xp):
+        # First, second and third cell of every line, to gather whole (20, M) planes at once
+        self.line_first, self.line_second, self.line_third = (xp.asarray(cells) for cells in LINE_INDEX.T)
+        self.gravity_lines = xp.asarray(_LINE_GRAVITY[:, None])
+        self.free_lines = ~self.gravity_lines
+        self.attack_groups = tuple((weight, xp.asarray(lines)) for weight, lines in _weight_groups(_LINE_ATTACK))
+        self.block_groups = tuple((weight, xp.asarray(lines)) for weight, lines in _weight_groups(_LINE_BLOCK))
+        self.center_bottom = xp.asarray(_cells(CENTER_BOTTOM))
+        self.center_column = xp.asarray(_cells(CENTER_COLUMN))
+        self.middle_columns = xp.asarray(_cells(MIDDLE_COLUMNS))
+
+
+@lru_cache(maxsize=None)
+def _tables(xp):
+    """Get the tables for an array module, copying them to its device once."""
+    return _Tables(xp)
+
+
+def _array_module(array):
+    """Return cupy for a CuPy array and numpy otherwise."""
+    return np if cupy is None else cupy.get_array_module(array)
+
+
+def _count(flags):
+    """Count the true entries along the first axis; summing an int8 view is much faster than a bool sum."""
+    return flags.view(np.int8).sum(axis=0, dtype=np.int8)
+
+
+def _weighted_count(groups, flags):
+    """Sum of the weights of the set lines, shape (M,); counting per weight group beats a matmul."""
+    return sum(weight * _count(flags[lines]) for weight, lines in groups)
+
+
+def _line_any(t, flags):
+    """Whether any cell of each line is set, shape (20, M)."""
+    return flags[t.line_first] | flags[t.line_second] | flags[t.line_third]
+
+
+def _line_count(t, flags):
+    """Number of set cells in each line, shape (20, M)."""
+    counts = flags.view(np.int8)
+    return counts[t.line_first] + counts[t.line_second] + counts[t.line_third]
+
+
+def _check_win_batch(cells, players):
+    """
+    Check which boards contain a complete line for their player.
+
+    Args:
+        cells: Boards in cell-major layout, shape (15, M)
+        players: Player to check each board for, shape (M,)
+
+    Returns:
+        Whether each board is won, shape (M,)
+    """
+    # A line is complete when the player owns all three of its cells
+    t = _tables(_array_module(cells))
+    owned = cells == players
+    return (owned[t.line_first] & owned[t.line_second] & owned[t.line_third]).any(axis=0)
+
+
+def _player_value(t, own, opponent, player_lines, opponent_lines, player_threats, opponent_threats, first_move):
+    """Combine the line and position terms of a batch of boards into the value for one side."""
+    values = _weighted_count(t.attack_groups, player_threats) - _weighted_count(t.block_groups, opponent_threats)
+    values += _count(player_lines) - 0.7 * _count(opponent_lines)
+
+    # Forks (multiple immediate threats)
+    values += 8.0 * (_count(player_threats) >= 2)
+    values -= 11.0 * (_count(opponent_threats) >= 2)
+
+    # Strategic positions: bottom center, middle column, middle three columns
+    values += 0.4 * own[t.center_bottom][0] - 0.3 * opponent[t.center_bottom][0]
+    values += 0.3 * _count(own[t.center_column]) - 0.2 * _count(opponent[t.center_column])
+    player_middle = _count(own[t.middle_columns])
+    values += 0.2 * player_middle - 0.15 * _count(opponent[t.middle_columns])
+
+    # First-move advantage: in the early game player 1 should take center positions
+    values += 0.2 * player_middle * first_move
+    return values
+
+
+def _state_value_pair(cells, players):
+    """
+    Evaluate a batch of boards for both sides at once; the line scans are shared.
+
+    Returns:
+        The state value of every board for players and for 3 - players, shape (M,) each
+    """
+    t = _tables(_array_module(cells))
+    own = cells == players
+    opponent = cells == 3 - players
+    empty = cells == 0
+    # Empty cells a piece would land in right now: bottom row or directly on top of a piece
+    droppable = empty.copy()
+    droppable[:10] &= ~empty[5:]
+
+    # Two in a line with the third cell open is a potential threat; it is an immediate
+    # threat when the open cell can be played now (diagonals skip the gravity check)
+    open_line = _line_any(t, empty)
+    immediate = (t.gravity_lines & _line_any(t, droppable)) | (t.free_lines & open_line)
+    player_lines = open_line & (_line_count(t, own) == 2)
+    opponent_lines = open_line & (_line_count(t, opponent) == 2)
+    player_threats = player_lines & immediate
+    opponent_threats = opponent_lines & immediate
+
+    early = _count(~empty) <= 2
+    return (
+        _player_value(
+            t, own, opponent, player_lines, opponent_lines, player_threats, opponent_threats, early & (players == 1)
+        ),
+        _player_value(
+            t, opponent, own, opponent_lines, player_lines, opponent_threats, player_threats, early & (players == 2)
+        ),
+    )
+
+
+class VecConnectThreeEnv:
+    """
+    A batch of independent Connect Three games stepped together with NumPy.
+
+    Follows the rules and rewards of ConnectThreeEnv so the per-step Python
+    overhead is paid once for all games instead of once per game.
+
+    Boards are stored cell-major (structure of arrays): the value of one cell across
+    all games is contiguous, so every line check is a unit-stride pass over the batch.
+
+    With device="cuda" the batch lives on the GPU as CuPy arrays, and states, rewards and
+    dones are returned as CuPy arrays too. The step never copies data back to the host,
+    so the caller decides when to sync. This only pays off for large batches (thousands
+    of games); for small ones the launch overhead dominates and the CPU is faster.
+    """
+
+    def __init__(self, num_envs, intermediate_rewards=True, device="cpu"):
+        if device == "cuda" and cupy is None:
+            raise ImportError("device='cuda' requires CuPy, install the cupy package matching your CUDA version")
+        if device not in ("cpu", "cuda"):
+            raise ValueError(f"Unknown device {device!r}, expected 'cpu' or 'cuda'")
+        xp = cupy if device == "cuda" else np
+        self.xp = xp
+        self.num_envs = num_envs
+        self.intermediate_rewards = intermediate_rewards
+        # Boards are 3 x 5 x N, 0 for empty, 1 for player 1, 2 for player 2
+        self.cells = xp.zeros((3, 5, num_envs), dtype=np.int8)
+        self.current_player = xp.ones(num_envs, dtype=np.int8)
+        self.done = xp.zeros(num_envs, dtype=bool)
+        self.winner = xp.zeros(num_envs, dtype=np.int8)  # 0 while there is no winner
+        # Packed state keys (2 bits per cell, as ConnectThreeEnv), updated as pieces are placed
+        self.states = xp.zeros(num_envs, dtype=np.int64)
+        # Pieces per column and per board, so open rows and full boards need no board scans
+        self.heights = xp.zeros((5, num_envs), dtype=np.int8)
+        self.pieces = xp.zeros(num_envs, dtype=np.int8)
+        self._envs = xp.arange(num_envs)
+        # State value of every board for the player to move, carried over from the previous
+        # step so a step only evaluates the boards after the move (intermediate rewards only)
+        self._values = xp.zeros(num_envs, dtype=np.float64)
+
+    def reset(self, envs=None):
+        """
+        Reset all games and return their states.
+
+        Args:
+            envs: Boolean mask of the games to reset, for example the finished ones; all games when None
+        """
+        if envs is None:
+            envs = slice(None)
+        self.cells[:, :, envs] = 0
+        self.current_player[envs] = 1
+        self.done[envs] = False
+        self.winner[envs] = 0
+        self.states[envs] = 0
+        self.heights[:, envs] = 0
+        self.pieces[envs] = 0
+        self._values[envs] = 0.0  # The empty board is worth 0 to both players
+        return self._get_states()
+
+    def step(self, actions):
+        """
+        Drop a piece for the current player of every game.
+
+        Games that are already finished are left untouched and get a reward of 0.
+
+        Args:
+            actions: Column (0-4) for every game, shape (N,)
+
+        Returns:
+            states: The new state of every game, shape (N,)
+            rewards: Reward for every action, shape (N,)
+            dones: Whether every game is finished, shape (N,)
+        """
+        xp = self.xp
+        actions = xp.asarray(actions)
+        envs = self._envs
+        in_bounds = (actions >= 0) & (actions < 5)
+        columns = xp.where(in_bounds, actions, 0)
+        cells = self.cells.reshape(15, self.num_envs)
+        players = self.current_player
+
+        # Pieces stack from the bottom row (2) up, so a column has room while it holds fewer than 3
+        heights = self.heights[columns, envs]
+        active = ~self.done
+        placed = active & in_bounds & (heights < 3)
+
+        # The checks below run over the whole batch, which keeps them unit-stride; the
+        # results only count for the games that placed a piece
+        # Games that did not place a piece write back the cell they already hold, so the
+        # update is a plain scatter over the batch with no data-dependent shapes
+        targets = (2 - xp.minimum(heights, 2)) * 5 + columns
+        cells[targets, envs] = xp.where(placed, players, cells[targets, envs])
+        self.states |= xp.where(placed, players.astype(np.int64) << (2 * targets), 0)
+        self.heights[columns, envs] += placed
+        self.pieces += placed
+
+        won = placed & _check_win_batch(cells, players)
+        draw = placed & ~won & (self.pieces == 15)
+        ended = won | draw
+
+        rewards = xp.full(self.num_envs, -0.05, dtype=np.float32)
+        xp.copyto(rewards, 0.2, where=draw)
+        xp.copyto(rewards, xp.where(players == 1, 1.0, -1.0), where=won)
+        xp.copyto(rewards, 0.0, where=self.done)
+        xp.copyto(rewards, -10.0, where=active & ~placed)
+        # Only moves that did not end the game pass the turn
+        switch = placed & ~ended
+        if self.intermediate_rewards:
+            # Scaled improvement of the mover's state value on non-terminal moves
+            mover_values, next_values = _state_value_pair(cells, players)
+            improvement = mover_values - self._values
+            rewards += xp.where(switch & (improvement > 0), 0.1 * improvement, 0.0)
+            # The other side's value is the baseline for its move next step
+            self._values = xp.where(switch, next_values, mover_values)
+
+        xp.copyto(self.winner, players, where=won)
+        self.done |= ended
+        xp.copyto(self.current_player, 3 - players, where=switch)
+
+        return self._get_states(), rewards, self.done.copy()
+
+    def get_valid_actions(self):
+        """Return a (N, 5) boolean mask of the columns that still have room."""
+        return (self.heights < 3).T
+
+    def _get_states(self):
+        """Return the integer state of every game, as ConnectThreeEnv."""
+        return self.states.copy()
@@ -0,0 +1,173 @@
+import json
+import random
+
+import numpy as np
+import pytest
+from agent import QLearningAgent
+from environment import ConnectThreeEnv, mirror_state, state_to_string
+
+
+def _random_episodes(episodes, seed):
+    """Transitions (state, action, reward, next_state, next_valid_actions) of random games, one list per game."""
+    rng = random.Random(seed)
+    env = ConnectThreeEnv()
+    for _ in range(episodes):
+        state = env.reset()
+        valid_actions = env.get_valid_actions()
+        transitions = []
+        while not env.done and valid_actions:
+            action = rng.choice(valid_actions)
+            next_state, reward, done, _ = env.step(action)
+            next_valid_actions = [] if done else env.get_valid_actions()
+            transitions.append((state, action, reward, next_state, next_valid_actions))
+            state, valid_actions = next_state, next_valid_actions
+        yield transitions
+
+
+def test_mirror_images_share_q_rows():
+    """Learning the mirrored games fills the same Q-table rows as learning the games themselves."""
+    agent = QLearningAgent()
+    mirrored_agent = QLearningAgent()
+    for transitions in _random_episodes(300, 0):
+        for state, action, reward, next_state, next_valid_actions in transitions:
+            agent.update(state, action, reward, next_state, next_valid_actions)
+            mirrored_agent.update(
+                mirror_state(state),
+                4 - action,
+                reward,
+                mirror_state(next_state),
+                [4 - a for a in reversed(next_valid_actions)],
+            )
+
+    assert list(mirrored_agent.index.items()) == list(agent.index.items())
+    for state, row in agent.index.items():
+        # A symmetric board is its own key, so there the mirrored moves land on the mirrored columns
+        expected = agent.q[row, ::-1] if mirror_state(state) == state else agent.q[row]
+        np.testing.assert_array_equal(mirrored_agent.q[row], expected)
+
+
+@pytest.mark.parametrize("capacity", [1, 3, 8, 50, 2_000_000])
+def test_update_batch_matches_update(capacity):
+    """Learning a game in one batch gives the Q-table of learning it one move at a time, evictions included."""
+    sequential = QLearningAgent(capacity=capacity)
+    batched = QLearningAgent(capacity=capacity)
+    for transitions in _random_episodes(300, capacity):
+        for transition in transitions:
+            sequential.update(*transition)
+        states, actions, rewards, next_states, next_valid_actions = zip(*transitions)
+        batched.update_batch(
+            np.array(states, dtype=np.int64),
+            np.array(actions),
+            np.array(rewards),
+            np.array(next_states, dtype=np.int64),
+            np.array([sum(1 << a for a in valid) for valid in next_valid_actions]),
+        )
+
+    assert list(batched.index.items()) == list(sequential.index.items())
+    np.testing.assert_allclose(batched.q, sequential.q, atol=1e-6)
+
+
+@pytest.mark.parametrize("extension", ["npz", "json"])
+def test_loading_more_states_than_the_capacity_raises(tmp_path, extension):
+    """A saved table larger than the capacity is rejected instead of leaving the agent over its cap."""
+    agent = QLearningAgent()
+    for transitions in _random_episodes(20, 0):
+        for transition in transitions:
+            agent.update(*transition)
+    filename = tmp_path / f"qtable.{extension}"
+    getattr(agent, f"save_qtable_{extension}")(filename)
+
+    small = QLearningAgent(capacity=10)
+    with pytest.raises(ValueError, match="capacity"):
+        getattr(small, f"load_qtable_{extension}")(filename)
+
+    fits = QLearningAgent(capacity=agent.get_q_table_size())
+    getattr(fits, f"load_qtable_{extension}")(filename)
+    assert fits.get_q_table_size() == agent.get_q_table_size()
+
+
+def _trained_agent(episodes=300, seed=0):
+    """An agent that learned from random games, one move at a time."""
+    agent = QLearningAgent()
+    for transitions in _random_episodes(episodes, seed):
+        for transition in transitions:
+            agent.update(*transition)
+    return agent
+
+
+def test_json_round_trip(tmp_path):
+    """The JSON holds every board as the plugin sees it, mirror images included, and loads back to the same table."""
+    agent = _trained_agent()
+    filename = tmp_path / "qtable.json"
+    agent.save_qtable_json(filename)
+
+    with open(filename) as f:
+        json_table = json.load(f)
+    expected = {}
+    for state, row in agent.index.items():
+        expected[state_to_string(mirror_state(state))] = agent.q[row, ::-1].tolist()
+        # A symmetric board is its own mirror image and keeps its row as it is
+        expected[state_to_string(state)] = agent.q[row].tolist()
+    assert json_table == expected
+
+    loaded = QLearningAgent()
+    loaded.load_qtable_json(filename)
+    assert list(loaded.index) == list(agent.index)
+    np.testing.assert_array_equal(loaded.q[list(loaded.index.values())], agent.q[list(agent.index.values())])
+
+
+def _q_by_state(agent):
+    """Q-values of the agent's states, in sorted state order."""
+    states = sorted(agent.index)
+    return states, agent.q[[agent.index[state] for state in states]]
+
+
+@pytest.mark.parametrize("quantize", [True, False])
+def test_npz_round_trip(tmp_path, quantize):
+    """Loading a saved archive restores every state; int16 quantization is off by at most half a scale step."""
+    agent = _trained_agent()
+    filename = tmp_path / "qtable.npz"
+    agent.save_qtable_npz(filename, quantize=quantize)
+    loaded = QLearningAgent()
+    loaded.load_qtable_npz(filename)
+
+    states, q = _q_by_state(agent)
+    loaded_states, loaded_q = _q_by_state(loaded)
+    assert loaded_states == states
+    if quantize:
+        with np.load(filename) as data:
+            scale = float(data["scale"])
+        assert scale == pytest.approx(np.abs(q).max() / np.iinfo(np.int16).max)
+        # Plus the float32 rounding of the restored values
+        assert np.abs(loaded_q - q).max() <= scale / 2 + np.abs(q).max() * np.finfo(np.float32).eps
+    else:
+        np.testing.assert_array_equal(loaded_q, q)
+
+
+def test_merged_changed_only_checkpoints_match_a_full_save(tmp_path):
+    """Merging the changed-only checkpoints in order rebuilds the table a full save holds."""
+    agent = QLearningAgent()
+    checkpoints = []
+    for seed in range(4):
+        for transitions in _random_episodes(100, seed):
+            for transition in transitions:
+                agent.update(*transition)
+        checkpoints.append(tmp_path / f"qtable_{seed}.npz")
+        agent.save_qtable_npz(checkpoints[-1], quantize=False, changed_only=True)
+    agent.save_qtable_npz(tmp_path / "qtable_full.npz", quantize=False)
+
+    # Later checkpoints only hold the states learned from since the previous one
+    with np.load(checkpoints[-1]) as data:
+        assert 0 < len(data["keys"]) < agent.get_q_table_size()
+
+    merged = QLearningAgent()
+    merged.load_qtable_npz(checkpoints[0])
+    for checkpoint in checkpoints[1:]:
+        merged.merge_qtable_npz(checkpoint)
+    full = QLearningAgent()
+    full.load_qtable_npz(tmp_path / "qtable_full.npz")
+
+    merged_states, merged_q = _q_by_state(merged)
+    full_states, full_q = _q_by_state(full)
+    assert merged_states == full_states
+    np.testing.assert_array_equal(merged_q, full_q)
@@ -0,0 +1,136 @@
+import random
+
+import numpy as np
+import pytest
+from environment import (
+    ConnectThreeEnv,
+    canonical_state_nb,
+    canonical_states,
+    mirror_state,
+    mirror_state_nb,
+    state_to_string,
+)
+
+
+def _random_games(games, seed):
+    """Yield (env, action) for every move of random games."""
+    rng = random.Random(seed)
+    env = ConnectThreeEnv()
+    for _ in range(games):
+        env.reset()
+        while not env.done:
+            yield env, rng.choice(env.get_valid_actions())
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_incremental_reward_matches_full_state_value(seed):
+    """The reward from the lines a move touches equals the one from evaluating the whole board before and after."""
+    for env, action in _random_games(500, seed):
+        player = env.current_player
+        value_before = env._calculate_state_value(player)
+        _, reward, done, _ = env.step(action)
+        if done:
+            continue
+        improvement = env._calculate_state_value(player) - value_before
+        assert reward == pytest.approx(-0.05 + 0.1 * max(improvement, 0.0), abs=1e-9)
+
+
+class _GridEnv:
+    """The rules of the original array-based ConnectThreeEnv, without intermediate rewards."""
+
+    def __init__(self):
+        self.board = [[0] * 5 for _ in range(3)]
+        self.current_player = 1
+        self.done = False
+        self.winner = None
+
+    def state_string(self):
+        return "".join(str(cell) for row in self.board for cell in row)
+
+    def valid_actions(self):
+        return [col for col in range(5) if self.board[0][col] == 0]
+
+    def won(self):
+        player = self.current_player
+        for r in range(3):
+            for c in range(5):
+                for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    cells = [(r + k * dr, c + k * dc) for k in range(3)]
+                    if all(0 <= rr < 3 and 0 <= cc < 5 and self.board[rr][cc] == player for rr, cc in cells):
+                        return True
+        return False
+
+    def step(self, action):
+        if action not in self.valid_actions():
+            return -10
+        row = max(r for r in range(3) if self.board[r][action] == 0)
+        self.board[row][action] = self.current_player
+        if self.won():
+            self.done = True
+            self.winner = self.current_player
+            return 1.0 if self.current_player == 1 else -1.0
+        if all(all(row) for row in self.board):
+            self.done = True
+            return 0.2
+        self.current_player = 3 - self.current_player
+        return -0.05
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_bitboard_env_follows_the_board_rules(seed):
+    """States, rewards, outcomes and valid moves match a plain 3x5 grid, invalid moves included."""
+    rng = random.Random(seed)
+    env = ConnectThreeEnv(intermediate_rewards=False)
+    for _ in range(500):
+        env.reset()
+        grid = _GridEnv()
+        while not grid.done:
+            assert list(env.get_valid_actions()) == grid.valid_actions()
+            # Now and then an out-of-range move or a move into a full column
+            full_columns = [col for col in range(5) if col not in grid.valid_actions()]
+            if rng.random() < 0.1:
+                action = rng.choice([-1, 5] + full_columns)
+            else:
+                action = rng.choice(grid.valid_actions())
+
+            state, reward, done, invalid = env.step(action)
+            expected_reward = grid.step(action)
+            assert state_to_string(state) == grid.state_string()
+            assert reward == pytest.approx(expected_reward)
+            assert invalid == (expected_reward == -10)
+            assert (done, env.winner, env.current_player) == (grid.done, grid.winner, grid.current_player)
+
+
+def test_mirrored_game_plays_like_the_original():
+    """Playing column 4 - c for every move c gives the mirrored states with the same rewards and outcome."""
+    rng = random.Random(0)
+    for _ in range(200):
+        env, mirrored_env = ConnectThreeEnv(), ConnectThreeEnv()
+        env.reset()
+        mirrored_env.reset()
+        while not env.done:
+            action = rng.choice(env.get_valid_actions())
+            state, reward, done, _ = env.step(action)
+            mirrored_state, mirrored_reward, mirrored_done, _ = mirrored_env.step(4 - action)
+            assert mirrored_state == mirror_state(state)
+            assert mirrored_reward == pytest.approx(reward)
+            assert (mirrored_done, mirrored_env.winner) == (done, env.winner)
+
+
+def test_canonical_state_is_shared_by_mirror_images():
+    """A state and its mirror image map to the smaller of the two, by every mirror helper."""
+    states = [env.step(action)[0] for env, action in _random_games(200, 0)]
+    for state in states:
+        rows = state_to_string(state)
+        mirrored = mirror_state(state)
+        assert state_to_string(mirrored) == "".join(rows[r : r + 5][::-1] for r in range(0, 15, 5))
+        assert mirror_state_nb(state) == mirrored
+        assert mirror_state(mirrored) == state
+
+        key, was_mirrored = canonical_state_nb(state)
+        assert key == min(state, mirrored)
+        assert was_mirrored == (mirrored < state)
+        assert canonical_state_nb(mirrored)[0] == key
+
+    keys, mirrored = canonical_states(np.array(states, dtype=np.int64))
+    assert list(zip(keys.tolist(), mirrored.tolist())) == [canonical_state_nb(state) for state in states]
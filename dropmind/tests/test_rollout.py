@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from agent import QLearningAgent
+from environment import ConnectThreeEnv
+from rollout import play_episodes, play_episodes_vec
+
+
+def _snapshot(seed):
+    """Snapshot of a Q-table over the states of random games, with random Q-values so greedy moves have no ties."""
+    rng = np.random.default_rng(seed)
+    agent = QLearningAgent(seed=seed)
+    env = ConnectThreeEnv()
+    for _ in range(300):
+        state = env.reset()
+        while not env.done:
+            valid_actions = env.get_valid_actions()
+            action = valid_actions[rng.integers(len(valid_actions))]
+            next_state, reward, done, _ = env.step(action)
+            agent.update(state, action, reward, next_state, [] if done else env.get_valid_actions())
+            state = next_state
+    keys, q = agent.snapshot()
+    return keys, rng.random(q.shape).astype(np.float32)
+
+
+def _rollout_args(n, primary_exploration_rate, opponent_exploration_rate, intermediate_rewards):
+    """Arguments for n games between two snapshots, the primary agent playing player 1 and 2 in turn."""
+    primary_keys, primary_q = _snapshot(0)
+    opponent_keys, opponent_q = _snapshot(1)
+    players = (np.arange(n) % 2 + 1).astype(np.int8)
+    return (
+        primary_keys,
+        primary_q,
+        opponent_keys,
+        opponent_q,
+        players,
+        np.full(n, primary_exploration_rate),
+        np.full(n, opponent_exploration_rate),
+        np.arange(n),
+        intermediate_rewards,
+    )
+
+
+@pytest.mark.parametrize("play", [play_episodes, play_episodes_vec])
+@pytest.mark.parametrize("intermediate_rewards", [True, False])
+def test_rollouts_replay_on_env(play, intermediate_rewards):
+    """Every recorded game replays move for move on ConnectThreeEnv: states, valid moves, rewards and winner."""
+    states, actions, rewards, valid_masks, lengths, winners = play(*_rollout_args(300, 0.5, 0.3, intermediate_rewards))
+    for g in range(300):
+        env = ConnectThreeEnv(intermediate_rewards=intermediate_rewards)
+        state = env.reset()
+        for move in range(lengths[g]):
+            assert states[g, move] == state
+            assert valid_masks[g, move] == sum(1 << a for a in env.get_valid_actions())
+            state, reward, _, invalid = env.step(int(actions[g, move]))
+            assert not invalid
+            assert rewards[g, move] == pytest.approx(reward, abs=1e-4)
+        assert env.done
+        assert states[g, lengths[g]] == state
+        assert winners[g] == (env.winner or 0)
+
+
+@pytest.mark.parametrize("intermediate_rewards", [True, False])
+def test_greedy_rollouts_agree(intermediate_rewards):
+    """Without exploration nothing is left to chance, so the compiled and vectorized rollouts play the same games."""
+    args = _rollout_args(300, 0.0, 0.0, intermediate_rewards)
+    for compiled, vectorized in zip(play_episodes(*args), play_episodes_vec(*args)):
+        np.testing.assert_allclose(compiled, vectorized, atol=1e-4)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from environment import ConnectThreeEnv
+from vec_environment import VecConnectThreeEnv
+
+
+def _assert_matches_env_step_for_step(intermediate_rewards, device="cpu", to_numpy=np.asarray):
+    """Play random moves on a batch and on one ConnectThreeEnv per game, comparing them after every step."""
+    rng = np.random.default_rng(0)
+    num_envs = 128
+    for _ in range(5):
+        vec_env = VecConnectThreeEnv(num_envs, intermediate_rewards=intermediate_rewards, device=device)
+        envs = [ConnectThreeEnv(intermediate_rewards=intermediate_rewards) for _ in range(num_envs)]
+        assert to_numpy(vec_env.reset()).tolist() == [env.reset() for env in envs]
+
+        # Enough steps to finish every game, even with invalid moves in between
+        for _ in range(60):
+            actions = rng.integers(-1, 6, num_envs)
+            states, rewards, dones = map(to_numpy, vec_env.step(actions))
+            valid = to_numpy(vec_env.get_valid_actions())
+            winner = to_numpy(vec_env.winner)
+            for i, env in enumerate(envs):
+                if env.done:
+                    # Finished games are left as they are
+                    assert dones[i] and rewards[i] == 0
+                    continue
+                state, reward, done, _ = env.step(int(actions[i]))
+                assert states[i] == state
+                assert rewards[i] == pytest.approx(reward, abs=1e-4)
+                assert dones[i] == done
+                assert winner[i] == (env.winner or 0)
+                if not done:
+                    assert np.flatnonzero(valid[i]).tolist() == list(env.get_valid_actions())
+        assert all(env.done for env in envs)
+
+
+@pytest.mark.parametrize("intermediate_rewards", [True, False])
+def test_vec_env_matches_env_step_for_step(intermediate_rewards):
+    """Every game of the batch plays exactly like its own ConnectThreeEnv, invalid moves included."""
+    _assert_matches_env_step_for_step(intermediate_rewards)
+
+
+@pytest.mark.parametrize("intermediate_rewards", [True, False])
+def test_vec_env_on_cuda_matches_env_step_for_step(intermediate_rewards):
+    """The same on the GPU, with the batch held in CuPy arrays."""
+    cupy = pytest.importorskip("cupy")
+    _assert_matches_env_step_for_step(intermediate_rewards, device="cuda", to_numpy=cupy.asnumpy)